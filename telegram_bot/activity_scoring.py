@@ -0,0 +1,128 @@
+from collections import deque
+from reference_data import activity_type_rules
+
+# Сколько различных описаний пунктов запоминается вместе с найденными подстроками
+# (формулировки пунктов теста повторяются от выгрузки к выгрузке)
+MATCH_CACHE_SIZE = 10000
+TASK_FIELDS = ("task1", "task3")
+
+
+class AhoCorasick:
+    """Автомат Ахо — Корасик: все подстроки из набора, входящие в текст, за один проход."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._output = [()]
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._output.append(())
+                node = next_node
+            self._output[node] += (index,)
+        # Суффиксные ссылки строятся обходом в ширину; переходы по ним сразу сворачиваются
+        # в полную таблицу, чтобы поиск делал ровно один переход на символ
+        fail = [0] * len(self._goto)
+        self._delta = [dict(self._goto[0])] + [None] * (len(self._goto) - 1)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            self._delta[node] = {**self._delta[fail[node]], **self._goto[node]}
+            self._output[node] += self._output[fail[node]]
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail[child] = self._delta[fail[node]].get(char, 0)
+
+    def find_all(self, text):
+        """Индексы подстрок, входящих в text."""
+        delta, output = self._delta, self._output
+        found = set(output[0])
+        node = 0
+        for char in text:
+            node = delta[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class ActivityScorer:
+    """
+    Скомпилированные правила подсчёта баллов типов деятельности.
+    Подстроки всех правил ищутся одним автоматом, каждое описание приводится к нижнему регистру один раз.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.types = list(dict.fromkeys(rule["type"] for rule in self.rules))
+        patterns = sorted({rule[field].lower() for rule in self.rules for field in TASK_FIELDS if field in rule})
+        pattern_ids = {pattern: index for index, pattern in enumerate(patterns)}
+        self._pattern_count = len(patterns)
+        self._rule_patterns = [
+            tuple(pattern_ids[rule[field].lower()] if field in rule else None for field in TASK_FIELDS)
+            for rule in self.rules
+        ]
+        self._rule_types = [self.types.index(rule["type"]) for rule in self.rules]
+        self._automaton = AhoCorasick(patterns)
+        self._matches = {}
+
+    def _match(self, description):
+        found = self._matches.get(description)
+        if found is None:
+            if len(self._matches) >= MATCH_CACHE_SIZE:
+                self._matches.clear()
+            found = self._matches[description] = tuple(self._automaton.find_all(description.lower()))
+        return found
+
+    def _totals(self, items):
+        # По каждой подстроке: сумма баллов и число пунктов, в описании которых она встречается
+        sums = [0] * self._pattern_count
+        counts = [0] * self._pattern_count
+        for item in items:
+            for pattern_id in self._match(item["описание"]):
+                sums[pattern_id] += item["баллы"]
+                counts[pattern_id] += 1
+        return sums, counts
+
+    def rule_scores(self, task1_parsed, task3_parsed):
+        """Баллы по каждому правилу (в порядке правил)."""
+        sums1, counts1 = self._totals(task1_parsed)
+        sums3, counts3 = self._totals(task3_parsed)
+        scores = []
+        for pattern1, pattern3 in self._rule_patterns:
+            if pattern1 is not None and pattern3 is not None:
+                # Сумма (баллы задания 1 + баллы задания 3) по всем парам совпавших пунктов
+                scores.append(sums1[pattern1] * counts3[pattern3] + sums3[pattern3] * counts1[pattern1])
+            elif pattern1 is not None:
+                scores.append(sums1[pattern1])
+            elif pattern3 is not None:
+                scores.append(sums3[pattern3])
+            else:
+                scores.append(0)
+        return scores
+
+    def score(self, pdf_data):
+        """Вектор баллов по типам деятельности (в порядке self.types)."""
+        vector = [0] * len(self.types)
+        for type_index, total in zip(self._rule_types, self.rule_scores(pdf_data['task1_parsed'], pdf_data['task3_parsed'])):
+            if total > 0:
+                vector[type_index] += total
+        return vector
+
+    def score_many(self, results):
+        """Векторы баллов для множества сохранённых результатов разбора."""
+        return [self.score(pdf_data) for pdf_data in results]
+
+    def sorted_types(self, pdf_data):
+        """Типы деятельности с ненулевыми баллами по убыванию: [(type_name, score), ...]."""
+        scores = {}
+        for rule, total in zip(self.rules, self.rule_scores(pdf_data['task1_parsed'], pdf_data['task3_parsed'])):
+            if total > 0:
+                scores[rule["type"]] = scores.get(rule["type"], 0) + total
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+activity_scorer = ActivityScorer(activity_type_rules)
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import math
+import os
+import socket
+import time
+import logging
+from telegram.error import BadRequest
+from pdf_processor import aparse_and_cache_pdf, agenerate_all_resumes, render_pdf_bytes, get_pdf_output_path, generation_key, dossier_key
+from executor import run_io, run_cpu
+from dossier_store import dossier_store, content_hash
+from job_queue import (
+    job_queue, JOB_MAX_ATTEMPTS, JOB_MAX_IN_FLIGHT, ACTIVE_STAGES, PROCESSING_STAGES,
+    STAGE_QUEUED, STAGE_DOWNLOADED, STAGE_PARSED, STAGE_GENERATED, STAGE_RENDERED, STAGE_SENT, STAGE_FAILED,
+    STAGE_CANCELLED,
+)
+from job_progress import JobProgress
+
+logger = logging.getLogger(__name__)
+
+# Сколько задач досье обрабатывается одновременно в процессе (0 — бот только ставит задачи и отправляет готовые досье,
+# обработкой занимаются отдельные процессы worker.py)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Как часто свободный обработчик заглядывает в очередь, секунды (задачи могут ставить и другие процессы)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# Сохранять выгрузки и досье в downloads/; по умолчанию файлы скачиваются, разбираются и рендерятся в памяти
+KEEP_FILES = os.getenv("KEEP_FILES", "0") == "1"
+# Как часто выполняемая задача проверяет, не отменил ли её пользователь, секунды
+JOB_CANCEL_POLL = float(os.getenv("JOB_CANCEL_POLL", "1"))
+
+_wakeup = None
+
+
+class DownloadError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def input_file_path(file_id):
+    return os.path.join(os.getcwd(), "downloads", f"{file_id}.pdf")
+
+
+def job_resumes(job):
+    return job['prof_resume'], job['talents_resume'], job['final_resume']
+
+
+def wake_workers():
+    # Новая задача в очереди: свободные обработчики этого процесса берут её без ожидания опроса
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def queue_status_text(job_id):
+    """Текст для пользователя: обработка начинается сразу или номер в очереди и оценка ожидания."""
+    number, in_flight = await run_io(job_queue.position, job_id)
+    capacity = JOB_MAX_IN_FLIGHT or max(JOB_WORKERS, 1)
+    if not number or in_flight + number <= capacity:
+        return "Обрабатываю файл, пожалуйста, подождите..."
+    # Досье будет готово, когда выполнятся все задачи впереди и она сама (по capacity одновременно)
+    duration = await run_io(job_queue.typical_duration)
+    eta = max(1, math.ceil(math.ceil((in_flight + number) / capacity) * duration / 60))
+    return f"Файл в очереди: вы №{number}, ожидание ~{eta} мин. Досье придёт сюда автоматически."
+
+
+async def send_dossier(bot, chat_id, key, filename, load_dossier):
+    """
+    Отправляет досье. Если такое же досье уже отправлялось, пересылается по file_id Telegram
+    без рендеринга и повторной загрузки; иначе load_dossier() возвращает байты PDF.
+    """
+    file_id = await run_io(dossier_store.get_file_id, key)
+    if file_id:
+        try:
+            return await bot.send_document(chat_id=chat_id, document=file_id)
+        except BadRequest as e:
+            logger.warning(f"file_id досье больше не действителен ({e}), отправляем файл заново")
+            await run_io(dossier_store.forget_file_id, key)
+    dossier = await load_dossier()
+    sent = await bot.send_document(chat_id=chat_id, document=dossier, filename=filename)
+    await run_io(dossier_store.remember_file_id, key, sent.document.file_id)
+    return sent
+
+
+async def render_dossier_bytes(pdf_data, resumes):
+    dossier = await run_cpu(render_pdf_bytes, pdf_data, *resumes)
+    if KEEP_FILES:
+        await run_io(write_file, get_pdf_output_path(pdf_data['user_name']), dossier)
+    return dossier
+
+
+async def download_upload(bot, job):
+    try:
+        file = await bot.get_file(job['file_id'])
+        pdf = bytes(await file.download_as_bytearray())
+    except Exception as e:
+        raise DownloadError(str(e)) from e
+    if KEEP_FILES:
+        await run_io(write_file, input_file_path(job['file_id']), pdf)
+    # Тот же PDF мог прийти от другого пользователя под другим file_unique_id
+    digest = await run_io(content_hash, pdf)
+    await run_io(dossier_store.remember_upload, job['file_unique_id'], digest)
+    return pdf, digest
+
+
+# Стадии задачи: каждая получает задачу с результатами предыдущих стадий и JobProgress для сообщения о статусе
+# и возвращает поля для сохранения вместе со следующей стадией
+
+async def stage_download(bot, job, progress):
+    # Повторно присланный файл узнаём по file_unique_id и не скачиваем заново
+    generation = await run_io(generation_key)
+    digest = await run_io(dossier_store.lookup_upload, job['file_unique_id'])
+    cached = await run_io(dossier_store.get, digest, generation) if digest else None
+    pdf = None
+    if cached is None:
+        pdf, digest = await download_upload(bot, job)
+    return {'stage': STAGE_DOWNLOADED, 'pdf': pdf, 'digest': digest, 'generation': generation}
+
+
+async def stage_parse(bot, job, progress):
+    cached = await run_io(dossier_store.get, job['digest'], job['generation'])
+    if cached is not None:
+        logger.info(f"Выгрузка {job['digest'][:12]} уже обрабатывалась, используем сохранённые результаты")
+        pdf_data = cached['pdf_data']
+    else:
+        pdf = job['pdf']
+        if pdf is None:
+            # Выгрузка была в хранилище при скачивании, но с тех пор вытеснена
+            pdf, _ = await download_upload(bot, job)
+        # Тяжёлая работа выполняется вне event loop, чтобы не блокировать других пользователей
+        pdf_data = await aparse_and_cache_pdf(pdf)
+        await run_io(dossier_store.put_parsed, job['digest'], pdf_data)
+    return {'stage': STAGE_PARSED, 'pdf': None, 'pdf_data': json.dumps(pdf_data, ensure_ascii=False)}
+
+
+async def stage_generate(bot, job, progress):
+    cached = await run_io(dossier_store.get, job['digest'], job['generation'])
+    if cached is not None and cached['resumes'] is not None:
+        prof_resume, talents_resume, final_resume = cached['resumes']
+    else:
+        for section in ('prof_resume', 'talents_resume', 'final_resume'):
+            if job[section] is not None:
+                progress.step_done(section)
+
+        used_llm = False
+
+        def on_chunk(section, chunk):
+            nonlocal used_llm
+            used_llm = True
+            progress.chunk(section, chunk)
+
+        async def on_section(section, text):
+            # Каждый готовый раздел сохраняется сразу: после перезапуска LLM не вызывается повторно
+            await run_io(job_queue.checkpoint, job['id'], **{section: text})
+            progress.step_done(section)
+
+        prof_resume, talents_resume, final_resume = await agenerate_all_resumes(
+            json.loads(job['pdf_data']),
+            custom_prof_resume=job['prof_resume'],
+            custom_talents_resume=job['talents_resume'],
+            custom_final_resume=job['final_resume'],
+            on_section=on_section,
+            on_chunk=on_chunk
+        )
+        if used_llm:
+            # Для оценки ожидания в очереди учитываются только досье, которые генерировала модель
+            await run_io(job_queue.checkpoint, job['id'], used_llm=1)
+        await run_io(dossier_store.put_generated, job['digest'], job['generation'], (prof_resume, talents_resume, final_resume))
+    return {'stage': STAGE_GENERATED, 'prof_resume': prof_resume, 'talents_resume': talents_resume, 'final_resume': final_resume}
+
+
+async def stage_render(bot, job, progress):
+    pdf_data = json.loads(job['pdf_data'])
+    # Досье, уже лежащее в Telegram, не рендерится: оно будет переслано по file_id
+    if await run_io(dossier_store.get_file_id, dossier_key(pdf_data, *job_resumes(job))):
+        return {'stage': STAGE_RENDERED}
+    # У задачи пересоздания после правки (edit) нет выгрузки в хранилище: досье с правками туда не пишется
+    if job['digest'] is None:
+        return {'stage': STAGE_RENDERED, 'dossier': await render_dossier_bytes(pdf_data, job_resumes(job))}
+    cached = await run_io(dossier_store.get, job['digest'], job['generation'])
+    if cached is not None and cached['dossier'] is not None:
+        return {'stage': STAGE_RENDERED, 'dossier': cached['dossier']}
+    dossier = await render_dossier_bytes(pdf_data, job_resumes(job))
+    await run_io(dossier_store.put_dossier, job['digest'], job['generation'], dossier)
+    return {'stage': STAGE_RENDERED, 'dossier': dossier}
+
+
+STAGES = {
+    STAGE_QUEUED: stage_download,
+    STAGE_DOWNLOADED: stage_parse,
+    STAGE_PARSED: stage_generate,
+    STAGE_GENERATED: stage_render,
+}
+
+
+async def deliver_job(bot, job):
+    pdf_data = json.loads(job['pdf_data'])
+    resumes = job_resumes(job)
+
+    async def load_dossier():
+        return job['dossier'] if job['dossier'] is not None else await render_dossier_bytes(pdf_data, resumes)
+
+    filename = os.path.basename(get_pdf_output_path(pdf_data['user_name']))
+    await send_dossier(bot, job['chat_id'], dossier_key(pdf_data, *resumes), filename, load_dossier)
+
+
+async def supervise(job, work):
+    """
+    Продлевает lease задачи и следит за отменой: отменённая пользователем задача прерывается
+    сразу, вместе с потоковым запросом к Ollama. Возвращает True, если обработка отменена.
+    """
+    renewed = time.monotonic()
+    while not work.done():
+        await asyncio.sleep(JOB_CANCEL_POLL)
+        if await run_io(job_queue.cancel_requested, job['id']):
+            work.cancel()
+            return True
+        if time.monotonic() - renewed >= job_queue.lease_seconds / 3:
+            renewed = time.monotonic()
+            if not await run_io(job_queue.renew, job['id'], job['worker']):
+                logger.warning(f"Задача {job['id']} больше не принадлежит обработчику {job['worker']}")
+    return False
+
+
+async def fail_job(bot, job, error, text, progress=None):
+    await run_io(job_queue.finish, job['id'], STAGE_FAILED, error)
+    await (progress or JobProgress(bot, job)).finish("Не удалось подготовить досье.")
+    try:
+        await bot.send_message(chat_id=job['chat_id'], text=text)
+    except Exception:
+        logger.exception(f"Не удалось сообщить об ошибке задачи {job['id']}")
+
+
+async def check_cancelled(job):
+    if await run_io(job_queue.cancel_requested, job['id']):
+        raise JobCancelled()
+
+
+async def process_job(bot, job, deliver, progress):
+    # Отмена проверяется на границе каждой стадии; внутри стадии задачу прерывает supervise
+    while job['stage'] in STAGES:
+        await check_cancelled(job)
+        progress.stage(job['stage'])
+        result = await STAGES[job['stage']](bot, job, progress)
+        await run_io(job_queue.checkpoint, job['id'], **result)
+        job.update(result)
+    progress.stage(job['stage'])
+    if not deliver:
+        await run_io(job_queue.release, job['id'])
+        return False
+    await check_cancelled(job)
+    await deliver_job(bot, job)
+    await run_io(job_queue.finish, job['id'], STAGE_SENT)
+    await progress.finish("Досье готово.", completed=True)
+    return True
+
+
+async def run_job(bot, job, on_sent=None, deliver=True):
+    """
+    Проводит задачу через оставшиеся стадии, отправляет досье и вызывает on_sent(job).
+    С deliver=False задача после рендеринга отдаётся обратно в очередь: досье отправит бот.
+    """
+    if job['cancel_requested']:
+        # Отменена, пока выполнялась в упавшем процессе: бот только подтвердил запрос, итог сообщаем здесь
+        await run_io(job_queue.finish, job['id'], STAGE_CANCELLED)
+        await JobProgress(bot, job).finish("Обработка отменена.")
+        return
+    if job['attempts'] > JOB_MAX_ATTEMPTS:
+        logger.error(f"Задача {job['id']} прерывалась {job['attempts'] - 1} раз, прекращаем попытки")
+        await fail_job(bot, job, "превышено число попыток", "Произошла ошибка при обработке файла.")
+        return
+    if job['attempts'] > 1:
+        logger.info(f"Задача {job['id']} продолжается со стадии {job['stage']}")
+    # Сообщение о статусе показывает ход обработки до её завершения
+    progress = JobProgress(bot, job)
+    progress.start()
+    work = asyncio.create_task(process_job(bot, job, deliver, progress))
+    supervisor = asyncio.create_task(supervise(job, work))
+    try:
+        try:
+            sent = await work
+        except asyncio.CancelledError:
+            if not (supervisor.done() and not supervisor.cancelled() and supervisor.result()):
+                raise
+            raise JobCancelled()
+    except JobCancelled:
+        logger.info(f"Задача {job['id']} отменена пользователем на стадии {job['stage']}")
+        await run_io(job_queue.finish, job['id'], STAGE_CANCELLED)
+        await progress.finish("Обработка отменена.")
+        return
+    except asyncio.CancelledError:
+        # Остановка бота: задачу сразу забирает следующий запуск, не дожидаясь истечения lease
+        work.cancel()
+        await asyncio.shield(run_io(job_queue.release, job['id']))
+        raise
+    except DownloadError as e:
+        logger.exception("Ошибка при скачивании файла")
+        await fail_job(bot, job, str(e), "Произошла ошибка при скачивании файла.", progress)
+        return
+    except Exception as e:
+        logger.exception("Ошибка при обработке файла")
+        await fail_job(bot, job, str(e), "Произошла ошибка при обработке файла.", progress)
+        return
+    finally:
+        supervisor.cancel()
+        await progress.stop()
+    if sent and on_sent is not None:
+        try:
+            await on_sent(job)
+        except Exception:
+            logger.exception(f"Ошибка после отправки досье задачи {job['id']}")
+
+
+async def worker_loop(bot, worker, on_sent=None, stages=ACTIVE_STAGES, deliver=True):
+    while True:
+        _wakeup.clear()
+        try:
+            job = await run_io(job_queue.claim, worker, stages)
+        except Exception:
+            logger.exception("Ошибка чтения очереди задач")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(bot, job, on_sent, deliver)
+
+
+def start_workers(bot, on_sent=None, count=JOB_WORKERS, deliver=True):
+    """
+    Запускает обработчики очереди в текущем event loop; незавершённые задачи подхватываются сразу.
+    С deliver=True (бот) добавляется отправщик досье, отрендеренных отдельными процессами worker.py;
+    с deliver=False (worker.py) задачи доводятся только до рендеринга.
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Обработчиков задач досье: {count}")
+    stages = ACTIVE_STAGES if deliver else PROCESSING_STAGES
+    tasks = [
+        asyncio.create_task(worker_loop(bot, f"{prefix}:{number}", on_sent, stages, deliver))
+        for number in range(count)
+    ]
+    if deliver:
+        tasks.append(asyncio.create_task(worker_loop(bot, f"{prefix}:delivery", on_sent, (STAGE_RENDERED,))))
+    return tasks
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import logging
+import time
+from llm_cache import SQLiteStore, CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DOSSIER_STORE_ENABLED = os.getenv("DOSSIER_STORE_ENABLED", "1") == "1"
+DOSSIER_STORE_PATH = os.getenv("DOSSIER_STORE_PATH", os.path.join(CACHE_DIR, "dossiers.sqlite"))
+# Максимальное число выгрузок в хранилище (лишние вытесняются по LRU)
+DOSSIER_STORE_MAX_ENTRIES = int(os.getenv("DOSSIER_STORE_MAX_ENTRIES", "200"))
+# Сколько file_id отправленных досье помнить (записи маленькие, лишние вытесняются по LRU)
+SENT_FILES_MAX_ENTRIES = int(os.getenv("SENT_FILES_MAX_ENTRIES", "10000"))
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class DossierStore(SQLiteStore):
+    """
+    Хранилище обработанных выгрузок, адресуемое содержимым (SHA-256 байтов PDF).
+    Для выгрузки хранятся результат разбора, сгенерированные тексты и готовое досье.
+    Тексты и досье действительны только для того поколения промптов и модели, с которым созданы.
+    Отдельно хранятся file_id уже отправленных в Telegram досье, чтобы не загружать их повторно.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS uploads ("
+        " file_unique_id TEXT PRIMARY KEY,"
+        " content_hash TEXT NOT NULL,"
+        " created_at REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS dossiers ("
+        " content_hash TEXT PRIMARY KEY,"
+        " pdf_data TEXT NOT NULL,"
+        " generation TEXT,"
+        " prof_resume TEXT,"
+        " talents_resume TEXT,"
+        " final_resume TEXT,"
+        " dossier BLOB,"
+        " created_at REAL NOT NULL,"
+        " accessed_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS dossiers_accessed ON dossiers(accessed_at)",
+        "CREATE TABLE IF NOT EXISTS sent_files ("
+        " dossier_key TEXT PRIMARY KEY,"
+        " file_id TEXT NOT NULL,"
+        " accessed_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS sent_files_accessed ON sent_files(accessed_at)",
+    )
+
+    def __init__(self, path=DOSSIER_STORE_PATH, max_entries=DOSSIER_STORE_MAX_ENTRIES, enabled=DOSSIER_STORE_ENABLED):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+    def lookup_upload(self, file_unique_id):
+        """SHA-256 содержимого уже загружавшегося файла Telegram или None."""
+        if not self.enabled:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT content_hash FROM uploads WHERE file_unique_id = ?", (file_unique_id,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def remember_upload(self, file_unique_id, digest):
+        if not self.enabled:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (file_unique_id, content_hash, created_at) VALUES (?, ?, ?)",
+                (file_unique_id, digest, time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, digest, generation):
+        """
+        Запись выгрузки: {'pdf_data', 'resumes', 'dossier'} или None.
+        resumes и dossier равны None, если созданы другим поколением промптов.
+        """
+        if not self.enabled:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT pdf_data, generation, prof_resume, talents_resume, final_resume, dossier"
+                " FROM dossiers WHERE content_hash = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE dossiers SET accessed_at = ? WHERE content_hash = ?", (time.time(), digest))
+            conn.commit()
+        finally:
+            conn.close()
+        pdf_data, row_generation, prof_resume, talents_resume, final_resume, dossier = row
+        fresh = row_generation is not None and row_generation == generation
+        return {
+            'pdf_data': json.loads(pdf_data),
+            'resumes': (prof_resume, talents_resume, final_resume) if fresh else None,
+            'dossier': bytes(dossier) if fresh and dossier is not None else None,
+        }
+
+    def put_parsed(self, digest, pdf_data):
+        if not self.enabled:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO dossiers (content_hash, pdf_data, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (digest, json.dumps(pdf_data, ensure_ascii=False), now, now)
+            )
+            # Вытесняем давно не использованные выгрузки сверх лимита
+            conn.execute(
+                "DELETE FROM dossiers WHERE content_hash IN ("
+                " SELECT content_hash FROM dossiers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.execute("DELETE FROM uploads WHERE content_hash NOT IN (SELECT content_hash FROM dossiers)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def put_generated(self, digest, generation, resumes):
+        if not self.enabled:
+            return
+        prof_resume, talents_resume, final_resume = resumes
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE dossiers SET generation = ?, prof_resume = ?, talents_resume = ?, final_resume = ?, dossier = NULL"
+                " WHERE content_hash = ?",
+                (generation, prof_resume, talents_resume, final_resume, digest)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def put_dossier(self, digest, generation, dossier):
+        # Досье сохраняется, только если тексты в записи того же поколения
+        if not self.enabled:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE dossiers SET dossier = ? WHERE content_hash = ? AND generation = ?",
+                (dossier, digest, generation)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_file_id(self, dossier_key):
+        """file_id, под которым Telegram уже хранит такое же досье, или None."""
+        if not self.enabled:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT file_id FROM sent_files WHERE dossier_key = ?", (dossier_key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE sent_files SET accessed_at = ? WHERE dossier_key = ?", (time.time(), dossier_key))
+            conn.commit()
+            return row[0]
+        finally:
+            conn.close()
+
+    def remember_file_id(self, dossier_key, file_id):
+        if not self.enabled:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO sent_files (dossier_key, file_id, accessed_at) VALUES (?, ?, ?)",
+                (dossier_key, file_id, time.time())
+            )
+            conn.execute(
+                "DELETE FROM sent_files WHERE dossier_key IN ("
+                " SELECT dossier_key FROM sent_files ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (SENT_FILES_MAX_ENTRIES,)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def forget_file_id(self, dossier_key):
+        if not self.enabled:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM sent_files WHERE dossier_key = ?", (dossier_key,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def invalidate_generated(self):
+        # Результаты разбора остаются, сбрасываются только тексты LLM и готовые досье
+        if not self.enabled:
+            return 0
+        conn = self._connect()
+        try:
+            updated = conn.execute(
+                "UPDATE dossiers SET generation = NULL, prof_resume = NULL, talents_resume = NULL,"
+                " final_resume = NULL, dossier = NULL WHERE generation IS NOT NULL"
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info(f"Хранилище досье: сброшены тексты и досье для {updated} выгрузок")
+        return updated
+
+
+dossier_store = DossierStore()
@@ -0,0 +1,110 @@
+import glob
+import os
+import logging
+import re
+import urllib.request
+from emojipy import Emoji
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import paraparser
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Локальное хранилище PNG эмодзи (имена файлов как у emojione: 1f449.png, 2714.png)
+EMOJI_DIR = os.getenv("EMOJI_DIR", os.path.join(BASE_DIR, "emoji"))
+# Догружать ли отсутствующие эмодзи при рендеринге (0 — полностью офлайн, вместо картинки остаётся символ)
+EMOJI_FETCH_MISSING = os.getenv("EMOJI_FETCH_MISSING", "1") == "1"
+EMOJI_SOURCE_URL = Emoji.image_png_path
+
+# <img>, который генерирует Emoji.to_image: исходный символ в alt и код эмодзи в имени файла
+EMOJI_IMG_RE = re.compile(r'<img[^>]*?alt="([^"]*)"[^>]*?src="[^"]*?/([0-9a-f]+(?:-[0-9a-f]+)*)\.png"[^>]*/>')
+
+_missing_codes = set()
+_image_cache = {}
+
+
+def fetch_emoji(code):
+    path = os.path.join(EMOJI_DIR, f"{code}.png")
+    os.makedirs(EMOJI_DIR, exist_ok=True)
+    try:
+        with urllib.request.urlopen(f"{EMOJI_SOURCE_URL}{code}.png", timeout=10) as response:
+            data = response.read()
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить эмодзи {code}: {e}")
+        return None
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def emoji_path(code, fetch=EMOJI_FETCH_MISSING):
+    """Путь к локальному PNG эмодзи или None, если его нет в хранилище (и его не удалось догрузить при fetch)."""
+    path = os.path.join(EMOJI_DIR, f"{code}.png")
+    if os.path.exists(path):
+        return path
+    if not fetch or code in _missing_codes:
+        return None
+    if fetch_emoji(code):
+        return path
+    _missing_codes.add(code)
+    return None
+
+
+def localize_emoji_images(text, size, fetch=EMOJI_FETCH_MISSING):
+    # Заменяем удалённые src на локальные файлы и задаём размер
+    def replace(match):
+        path = emoji_path(match.group(2), fetch)
+        if path is None:
+            return match.group(1)
+        return f'<img height="{size}" width="{size}" src="{path}"/>'
+    return EMOJI_IMG_RE.sub(replace, text)
+
+
+def emoji_to_pdf_markup(text, size, fetch=EMOJI_FETCH_MISSING):
+    # Конвертируем эмодзи в теги <img> с локальным src и размером size (в пикселях)
+    return localize_emoji_images(Emoji.to_image(text), size, fetch)
+
+
+def cached_image_reader(src, *args, **kwargs):
+    # Картинки эмодзи читаются с диска один раз на процесс, дальше берутся из памяти
+    if isinstance(src, str) and src.startswith(EMOJI_DIR):
+        reader = _image_cache.get(src)
+        if reader is None:
+            reader = _image_cache[src] = ImageReader(src, *args, **kwargs)
+        return reader
+    return ImageReader(src, *args, **kwargs)
+
+
+def install_image_cache():
+    # paraparser создаёт ImageReader на каждый <img> в абзаце
+    paraparser.ImageReader = cached_image_reader
+
+
+def warm(texts):
+    """Загружает в локальное хранилище все эмодзи, встречающиеся в текстах."""
+    codes = set()
+    for text in texts:
+        codes.update(code for alt, code in EMOJI_IMG_RE.findall(Emoji.to_image(text)))
+    fetched = 0
+    for code in sorted(codes):
+        if not os.path.exists(os.path.join(EMOJI_DIR, f"{code}.png")) and fetch_emoji(code):
+            fetched += 1
+    return len(codes), fetched
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Эмодзи из справочников, промптов и шаблонов разделов
+    texts = []
+    for pattern in ("*.py", "*.yaml"):
+        for path in glob.glob(os.path.join(BASE_DIR, pattern)):
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+    total, fetched = warm(texts)
+    logger.info(f"Эмодзи в хранилище: {total}, загружено сейчас: {fetched}")
+
+
+if __name__ == "__main__":
+    main()
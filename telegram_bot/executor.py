@@ -0,0 +1,78 @@
+import asyncio
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Пул потоков для I/O-bound работы (запросы к LLM и т.п.)
+IO_POOL_SIZE = int(os.getenv("IO_POOL_SIZE", "8"))
+# Пул процессов для CPU-bound работы (разбор PDF, рендеринг ReportLab)
+CPU_POOL_SIZE = int(os.getenv("CPU_POOL_SIZE", str(os.cpu_count() or 1)))
+
+_io_pool = None
+_cpu_pool = None
+_cpu_initializer = None
+
+
+def set_cpu_initializer(initializer):
+    # Вызывается в каждом процессе пула при старте (например, прогрев рендерера)
+    global _cpu_initializer
+    _cpu_initializer = initializer
+
+
+def get_io_pool():
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+        logger.info(f"Создан пул потоков для I/O: {IO_POOL_SIZE}")
+    return _io_pool
+
+
+def get_cpu_pool():
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_SIZE, initializer=_cpu_initializer)
+        logger.info(f"Создан пул процессов для CPU: {CPU_POOL_SIZE}")
+    return _cpu_pool
+
+
+def _noop():
+    pass
+
+
+async def start_cpu_pool():
+    """
+    Запускает процессы пула сразу, вместе с initializer (прогревом рендерера), а не при первом run_cpu:
+    иначе прогрев оплачивает досье первого пользователя.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_cpu_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, _noop) for _ in range(CPU_POOL_SIZE)))
+    logger.info("Пул процессов для CPU запущен")
+
+
+async def run_io(func, *args, **kwargs):
+    """Выполняет блокирующую I/O-функцию в пуле потоков, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_pool(), partial(func, *args, **kwargs))
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Выполняет CPU-bound функцию в пуле процессов.
+    Функция и аргументы должны сериализоваться через pickle.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_pool(), partial(func, *args, **kwargs))
+
+
+def shutdown_pools():
+    global _io_pool, _cpu_pool
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=False, cancel_futures=True)
+        _io_pool = None
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
@@ -0,0 +1,97 @@
+from collections import namedtuple
+from reference_data import types_info, hidden_talents_info, personality_info, orientations
+from emoji_store import emoji_to_pdf_markup
+from renderer import EMOJI_FONT_SIZE
+
+# Фрагмент текста раздела: raw — разметка для промптов, pdf — с эмодзи, уже заменёнными на <img>
+Fragment = namedtuple('Fragment', ['raw', 'pdf'])
+
+
+def make_fragment(raw):
+    # Фрагменты собираются при импорте в каждом процессе: эмодзи берутся только из локального хранилища,
+    # без сети (справочные эмодзи загружает туда `python emoji_store.py` при сборке образа)
+    return Fragment(raw, emoji_to_pdf_markup(raw, EMOJI_FONT_SIZE, fetch=False))
+
+
+def join_raw(fragments):
+    return "".join(fragment.raw for fragment in fragments)
+
+
+def join_pdf(fragments):
+    return "".join(fragment.pdf for fragment in fragments)
+
+
+def _prof_text(type_name):
+    parts = [f"<br/>👉 <b>{type_name} тип деятельности:</b><br/>"]
+    if type_name in types_info:
+        info = types_info[type_name]
+        parts.append(f"📝 {info['description']}<br/>")
+        parts.append("💼 Подходящие профессии:<br/>")
+        for prof in info["professions"]:
+            parts.append(f"   ✔️ {prof}<br/>")
+    return "".join(parts)
+
+
+def _talent_text(talent):
+    info = hidden_talents_info.get(talent)
+    if not info:
+        return f"<br/><br/>❗ Информация по таланту «{talent}» не найдена.<br/><br/>"
+    return (
+        f"<br/>✨ {talent}:<br/>"
+        f"📝 {info['description']}<br/><br/>"
+        "💡 Примеры реализации:<br/>"
+        f"{info['examples']}<br/>"
+    )
+
+
+def _personality_text(code):
+    info = personality_info[code]
+    parts = [
+        f"<br/><br/>🎭 Тип личности: {info['name']}<br/>",
+        f"📝 {info['description']}<br/><br/>",
+        "🚀 Давай разберём, что делает тебя таким особенным:<br/><br/>",
+    ]
+    for feature in info["features"]:
+        parts.append(f"🔑 {feature['feature']}:<br/>")
+        parts.append(f"📝 {feature['description']}<br/>")
+        parts.append(f"💡 {feature['examples']}<br/><br/>")
+    return "".join(parts)
+
+
+def _orientation_text(desc):
+    data = orientations.get(desc)
+    if not data:
+        return f"<br/><br/>❗ Нет данных для описания: {desc}<br/>"
+    return (
+        f"<br/>💡{data['ориентир']}<br/>"
+        f"📝{data['описание']}<br/>"
+        "✔️ Какой путь тебе подойдет?<br/>"
+        f"{data['путь']}<br/>"
+    )
+
+
+# Фрагменты для всех записей справочников собираются один раз при импорте
+PROF_FRAGMENTS = {type_name: make_fragment(_prof_text(type_name)) for type_name in types_info}
+TALENT_FRAGMENTS = {talent: make_fragment(_talent_text(talent)) for talent in hidden_talents_info}
+PERSONALITY_FRAGMENTS = {code: make_fragment(_personality_text(code)) for code in personality_info}
+ORIENTATION_FRAGMENTS = {desc: make_fragment(_orientation_text(desc)) for desc in orientations}
+ORIENTATIONS_INTRO = make_fragment(
+    "Твои ценностные ориентиры помогают тебе понять, что действительно важно для тебя в жизни и карьере. Реализуя их, ты можешь чувствовать себя максимально успешным и гармоничным в своей профессии. <br/> Давай разберём, что значит каждая из них и как они могут реализоваться:"
+)
+
+
+# Для значений вне справочников фрагмент собирается на лету
+def prof_fragment(type_name):
+    return PROF_FRAGMENTS.get(type_name) or make_fragment(_prof_text(type_name))
+
+
+def talent_fragment(talent):
+    return TALENT_FRAGMENTS.get(talent) or make_fragment(_talent_text(talent))
+
+
+def personality_fragment(code):
+    return PERSONALITY_FRAGMENTS.get(code)
+
+
+def orientation_fragment(desc):
+    return ORIENTATION_FRAGMENTS.get(desc) or make_fragment(_orientation_text(desc))
@@ -0,0 +1,193 @@
+import asyncio
+import datetime
+import os
+import time
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter, TelegramError
+from executor import run_io
+from job_queue import job_queue, STAGE_QUEUED, STAGE_DOWNLOADED, STAGE_PARSED, STAGE_GENERATED, STAGE_RENDERED
+
+logger = logging.getLogger(__name__)
+
+# Не чаще чем раз в столько секунд правится сообщение о статусе в одном чате (на все задачи чата в процессе):
+# Telegram допускает около одного сообщения в секунду в чате и 20 в минуту в группе. Интервал считается
+# отдельно в каждом процессе, поэтому задачи одного чата у N обработчиков правят его до N раз за интервал
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))
+# Сколько последних символов генерируемого текста показывать в сообщении о статусе (0 — не показывать)
+PROGRESS_PREVIEW_CHARS = int(os.getenv("PROGRESS_PREVIEW_CHARS", "300"))
+# Раз в столько секунд сообщение обновляется и без нового текста: растущее время шага выдаёт зависшую задачу
+PROGRESS_REFRESH = float(os.getenv("PROGRESS_REFRESH", "30"))
+
+STEPS = (
+    ('parsed', "Разбор выгрузки"),
+    ('prof_resume', "Профессиональные склонности"),
+    ('talents_resume', "Скрытые таланты"),
+    ('final_resume', "Итоговый вывод"),
+    ('rendered', "Оформление PDF"),
+)
+STEP_TITLES = dict(STEPS)
+# Шаги, которые выполняются на стадии задачи (разделы prof_resume и talents_resume генерируются параллельно)
+STAGE_STEPS = {
+    STAGE_QUEUED: ('parsed',),
+    STAGE_DOWNLOADED: ('parsed',),
+    STAGE_PARSED: ('prof_resume', 'talents_resume'),
+    STAGE_GENERATED: ('rendered',),
+    STAGE_RENDERED: (),
+}
+
+# Когда в чате можно следующий раз править сообщение (общее для всех задач процесса, но не для других
+# обработчиков: их правки в том же чате здесь не видны)
+_chat_next_edit = {}
+
+
+def cancel_markup(job_id):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Отменить", callback_data=f"cancel_job:{job_id}")]])
+
+
+def format_elapsed(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes} мин {seconds:02d} с" if minutes else f"{seconds} с"
+
+
+def reserve_edit(chat_id):
+    """Занимает ближайшее свободное время правки в чате; возвращает, сколько секунд до него ждать."""
+    now = time.monotonic()
+    at = max(now, _chat_next_edit.get(chat_id, 0))
+    _chat_next_edit[chat_id] = at + PROGRESS_EDIT_INTERVAL
+    return at - now
+
+
+class JobProgress:
+    """
+    Сообщение о статусе задачи, которое правится на месте: пройденные и текущие шаги со временем
+    и хвост текста, который сейчас генерирует LLM. Правки отправляет фоновый цикл не чаще
+    PROGRESS_EDIT_INTERVAL в чате, поэтому генерация их не ждёт, а лимиты Telegram не превышаются.
+    У задачи без сообщения о статусе (пересоздание после правки) ничего не показывает.
+    """
+
+    def __init__(self, bot, job):
+        self.bot = bot
+        self.job_id = job['id']
+        self.chat_id = job['chat_id']
+        self.message_id = job['status_message_id']
+        self.done = set()
+        self.active = {}
+        self.texts = {}
+        self.preview_section = None
+        self._shown = None
+        self._changed = asyncio.Event()
+        self._task = None
+
+    async def _resolve_message(self):
+        # Обработчик мог взять задачу раньше, чем бот сохранил id сообщения о статусе
+        if self.message_id is None:
+            job = await run_io(job_queue.get, self.job_id)
+            self.message_id = job['status_message_id'] if job else None
+        return self.message_id is not None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    def _activate(self, step):
+        if step not in self.done:
+            self.active.setdefault(step, time.monotonic())
+
+    def stage(self, stage):
+        # Стадия начинается: все шаги до её первого шага пройдены
+        steps = STAGE_STEPS.get(stage, ())
+        first = [name for name, _ in STEPS].index(steps[0]) if steps else len(STEPS)
+        for name, _ in STEPS[:first]:
+            self.step_done(name)
+        for step in steps:
+            self._activate(step)
+        self._changed.set()
+
+    def step_done(self, step):
+        self.done.add(step)
+        self.active.pop(step, None)
+        self.texts.pop(step, None)
+        # Итоговый вывод генерируется, когда готовы оба раздела, на которых он основан
+        if {'prof_resume', 'talents_resume'} <= self.done:
+            self._activate('final_resume')
+        self._changed.set()
+
+    def chunk(self, section, chunk):
+        self.texts[section] = self.texts.get(section, "") + chunk
+        self.preview_section = section
+        self._changed.set()
+
+    def render(self, title=None):
+        lines = [title or "Готовлю досье:", ""]
+        now = time.monotonic()
+        for step, step_title in STEPS:
+            if step in self.done:
+                lines.append(f"✅ {step_title}")
+            elif step in self.active and title is None:
+                lines.append(f"⏳ {step_title} — {format_elapsed(now - self.active[step])}")
+            else:
+                lines.append(f"▫️ {step_title}")
+        text = self.texts.get(self.preview_section)
+        if title is None and text and PROGRESS_PREVIEW_CHARS > 0:
+            preview = text[-PROGRESS_PREVIEW_CHARS:]
+            if len(text) > PROGRESS_PREVIEW_CHARS:
+                # Начинаем с целого слова
+                preview = "…" + preview.split(" ", 1)[-1]
+            lines += ["", f"{STEP_TITLES[self.preview_section]}:", preview.strip()]
+        return "\n".join(lines)
+
+    async def _edit(self, text, reply_markup=None):
+        """Правит сообщение о статусе; если Telegram просит подождать, возвращает, сколько секунд."""
+        if text == self._shown:
+            return None
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id, message_id=self.message_id, text=text, reply_markup=reply_markup
+            )
+            self._shown = text
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, datetime.timedelta):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Telegram просит подождать {retry_after} с перед правкой сообщений в чате {self.chat_id}")
+            _chat_next_edit[self.chat_id] = time.monotonic() + retry_after
+            return retry_after
+        except TelegramError as e:
+            # Например, пользователь удалил сообщение о статусе или пропала сеть
+            logger.warning(f"Не удалось обновить сообщение о статусе задачи {self.job_id}: {e}")
+        return None
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), PROGRESS_REFRESH)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            if not await self._resolve_message():
+                continue
+            # Пока ждём своей очереди на правку, изменения копятся и уходят одной правкой
+            await asyncio.sleep(reserve_edit(self.chat_id))
+            self._changed.clear()
+            await self._edit(self.render(), cancel_markup(self.job_id))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def finish(self, title, completed=False):
+        """Последняя правка: итог задачи без кнопки отмены и без текста генерации."""
+        await self.stop()
+        if not await self._resolve_message():
+            return
+        if completed:
+            self.done.update(name for name, _ in STEPS)
+        # Итог нельзя потерять: ждём своей очереди на правку, а после ответа «слишком часто» пробуем ещё раз
+        await asyncio.sleep(reserve_edit(self.chat_id))
+        retry_after = await self._edit(self.render(title))
+        if retry_after is not None:
+            # _edit уже сдвинул время следующей правки в чате на retry_after
+            await asyncio.sleep(reserve_edit(self.chat_id))
+            await self._edit(self.render(title))
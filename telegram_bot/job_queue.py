@@ -0,0 +1,435 @@
+import os
+import logging
+import statistics
+import time
+from llm_cache import SQLiteStore, CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(CACHE_DIR, "jobs.sqlite"))
+# Сколько секунд задача принадлежит обработчику без продления; после этого её забирает другой обработчик
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Сколько раз задача берётся в работу на одной стадии, прежде чем считается безнадёжной
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Максимум задач в очереди (ожидающих и выполняемых); новые выгрузки сверх него отклоняются (0 — без ограничения)
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "50"))
+# Сколько задач одновременно выполняется всеми обработчиками вместе (0 — без ограничения)
+JOB_MAX_IN_FLIGHT = int(os.getenv("JOB_MAX_IN_FLIGHT", "4"))
+# Оценка длительности задачи, пока нет замеров, секунды
+JOB_DEFAULT_DURATION = float(os.getenv("JOB_DEFAULT_DURATION", "120"))
+# По скольким последним задачам считается типичная (медианная) длительность
+JOB_DURATION_WINDOW = 20
+# Сколько секунд хранятся завершённые задачи
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(24 * 3600)))
+
+# Стадии задачи досье по порядку: результат каждой стадии сохраняется в задаче,
+# после перезапуска работа продолжается с последней завершённой стадии
+STAGE_QUEUED = 'queued'
+STAGE_DOWNLOADED = 'downloaded'
+STAGE_PARSED = 'parsed'
+STAGE_GENERATED = 'generated'
+STAGE_RENDERED = 'rendered'
+STAGE_SENT = 'sent'
+STAGE_FAILED = 'failed'
+STAGE_CANCELLED = 'cancelled'
+# Стадии, которые проходят в обработчиках (worker.py); отрендеренное досье отправляет бот
+PROCESSING_STAGES = (STAGE_QUEUED, STAGE_DOWNLOADED, STAGE_PARSED, STAGE_GENERATED)
+ACTIVE_STAGES = PROCESSING_STAGES + (STAGE_RENDERED,)
+FINISHED_STAGES = (STAGE_SENT, STAGE_FAILED, STAGE_CANCELLED)
+
+# Классы приоритета (меньше — раньше): пересоздание досье после правки раздела дёшево и ждёт администратор,
+# новые выгрузки требуют трёх запросов к LLM, пакетная работа выполняется в последнюю очередь
+JOB_PRIORITIES = {'edit': 0, 'upload': 1, 'batch': 2}
+# Задачи, которые не обращаются к LLM: не учитываются в JOB_MAX_IN_FLIGHT и глубине очереди
+UNMETERED_KINDS = ('edit',)
+
+# Поля задачи, которые сохраняются по ходу обработки
+JOB_FIELDS = (
+    'status_message_id', 'section', 'pdf', 'digest', 'generation', 'pdf_data',
+    'prof_resume', 'talents_resume', 'final_resume', 'dossier', 'error', 'used_llm',
+)
+
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+# Порядок выдачи задач: класс приоритета, затем очередь чата по кругу — k-я активная задача чата
+# идёт после первых задач всех остальных чатов этого класса, затем время постановки.
+# Выполняемые задачи тоже занимают место в очереди своего чата.
+SCHEDULE_SQL = (
+    "SELECT *, ROW_NUMBER() OVER (PARTITION BY priority, chat_id ORDER BY id) AS turn"
+    f" FROM jobs WHERE stage IN ({_placeholders(ACTIVE_STAGES)})"
+)
+SCHEDULE_ORDER = "priority, turn, id"
+
+
+class JobQueue(SQLiteStore):
+    """
+    Очередь задач досье в локальном SQLite.
+    Обработчик забирает задачу во временное владение (lease) и продлевает его, пока работает;
+    задачу упавшего обработчика после истечения lease забирает другой.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " kind TEXT NOT NULL,"
+        " priority INTEGER NOT NULL,"
+        " chat_id INTEGER NOT NULL,"
+        " user_id INTEGER NOT NULL,"
+        " message_id INTEGER,"
+        " status_message_id INTEGER,"
+        " section TEXT,"
+        " file_id TEXT,"
+        " file_unique_id TEXT,"
+        " stage TEXT NOT NULL,"
+        " pdf BLOB,"
+        " digest TEXT,"
+        " generation TEXT,"
+        " pdf_data TEXT,"
+        " prof_resume TEXT,"
+        " talents_resume TEXT,"
+        " final_resume TEXT,"
+        " dossier BLOB,"
+        " error TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+        " used_llm INTEGER NOT NULL DEFAULT 0,"
+        " worker TEXT,"
+        " lease_until REAL,"
+        " started_at REAL,"
+        " created_at REAL NOT NULL,"
+        " updated_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS jobs_stage ON jobs(stage, priority, chat_id, id)",
+    )
+
+    def __init__(self, path=JOB_QUEUE_PATH, lease_seconds=JOB_LEASE_SECONDS):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.row_factory = _row_to_dict
+        return conn
+
+    def enqueue(self, kind, chat_id, user_id, message_id=None, file_id=None, file_unique_id=None,
+                max_depth=JOB_QUEUE_MAX_DEPTH, stage=STAGE_QUEUED, **fields):
+        """
+        Ставит задачу в очередь и возвращает её id; None, если очередь заполнена.
+        stage и fields позволяют поставить задачу сразу на позднюю стадию (например, только рендеринг).
+        """
+        unknown = set(fields) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Неизвестные поля задачи: {', '.join(sorted(unknown))}")
+        now = time.time()
+        columns = {
+            'kind': kind, 'priority': JOB_PRIORITIES[kind], 'chat_id': chat_id, 'user_id': user_id,
+            'message_id': message_id, 'file_id': file_id, 'file_unique_id': file_unique_id,
+            'stage': stage, 'created_at': now, 'updated_at': now, **fields,
+        }
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            if max_depth and kind not in UNMETERED_KINDS:
+                depth = conn.execute(
+                    f"SELECT COUNT(*) AS depth FROM jobs WHERE stage IN ({_placeholders(PROCESSING_STAGES)})"
+                    f" AND kind NOT IN ({_placeholders(UNMETERED_KINDS)})",
+                    (*PROCESSING_STAGES, *UNMETERED_KINDS)
+                ).fetchone()['depth']
+                if depth >= max_depth:
+                    conn.execute("COMMIT")
+                    logger.warning(f"Очередь задач заполнена ({depth}), задача для чата {chat_id} отклонена")
+                    return None
+            job_id = conn.execute(
+                f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({_placeholders(columns)})",
+                tuple(columns.values())
+            ).lastrowid
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        logger.info(f"Задача {job_id} ({kind}) поставлена в очередь для чата {chat_id}")
+        return job_id
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def claim(self, worker, stages=ACTIVE_STAGES, max_in_flight=JOB_MAX_IN_FLIGHT):
+        """
+        Забирает следующую по расписанию свободную задачу в одной из стадий stages или возвращает None.
+        Пока выполняется max_in_flight задач с LLM, выдаются только задачи без LLM и отправка готовых досье.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE: выбор и захват задачи атомарны и для нескольких процессов
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            condition = f"stage IN ({_placeholders(stages)}) AND (lease_until IS NULL OR lease_until < ?)"
+            params = [*stages, now]
+            if max_in_flight and self._in_flight(conn, now) >= max_in_flight:
+                condition += (
+                    f" AND (stage NOT IN ({_placeholders(PROCESSING_STAGES)})"
+                    f" OR kind IN ({_placeholders(UNMETERED_KINDS)}))"
+                )
+                params += [*PROCESSING_STAGES, *UNMETERED_KINDS]
+            job = conn.execute(
+                f"SELECT * FROM ({SCHEDULE_SQL}) WHERE {condition} ORDER BY {SCHEDULE_ORDER} LIMIT 1",
+                (*ACTIVE_STAGES, *params)
+            ).fetchone()
+            if job is not None:
+                conn.execute(
+                    "UPDATE jobs SET worker = ?, lease_until = ?, attempts = attempts + 1,"
+                    " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                    (worker, now + self.lease_seconds, now, job['id'])
+                )
+                job.update(worker=worker, lease_until=now + self.lease_seconds, attempts=job['attempts'] + 1)
+                del job['turn']
+            conn.execute("COMMIT")
+            return job
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _in_flight(conn, now):
+        return conn.execute(
+            f"SELECT COUNT(*) AS busy FROM jobs WHERE stage IN ({_placeholders(PROCESSING_STAGES)})"
+            f" AND kind NOT IN ({_placeholders(UNMETERED_KINDS)}) AND lease_until >= ?",
+            (*PROCESSING_STAGES, *UNMETERED_KINDS, now)
+        ).fetchone()['busy']
+
+    def position(self, job_id):
+        """
+        (номер задачи среди ожидающих задач с LLM в порядке выдачи; сколько задач с LLM выполняется сейчас).
+        Номер 0 — задача уже выполняется или завершена.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            waiting = conn.execute(
+                f"SELECT id FROM ({SCHEDULE_SQL}) WHERE stage IN ({_placeholders(PROCESSING_STAGES)})"
+                f" AND kind NOT IN ({_placeholders(UNMETERED_KINDS)}) AND (lease_until IS NULL OR lease_until < ?)"
+                f" ORDER BY {SCHEDULE_ORDER}",
+                (*ACTIVE_STAGES, *PROCESSING_STAGES, *UNMETERED_KINDS, now)
+            ).fetchall()
+            order = [row['id'] for row in waiting]
+            number = order.index(job_id) + 1 if job_id in order else 0
+            return number, self._in_flight(conn, now)
+        finally:
+            conn.close()
+
+    def pending(self):
+        """Есть ли задачи досье, ожидающие или выполняемые (для работы низшего приоритета)."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f"SELECT 1 FROM jobs WHERE stage IN ({_placeholders(PROCESSING_STAGES)}) AND priority < ? LIMIT 1",
+                (*PROCESSING_STAGES, JOB_PRIORITIES['batch'])
+            ).fetchone()
+            return row is not None
+        finally:
+            conn.close()
+
+    def typical_duration(self, window=JOB_DURATION_WINDOW):
+        """
+        Медиана длительности последних досье, тексты которых генерировала модель, секунды.
+        Досье из хранилища и кэша LLM готовы почти мгновенно и занизили бы оценку ожидания.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT updated_at - started_at AS duration FROM jobs"
+                " WHERE stage = ? AND kind = 'upload' AND used_llm = 1 AND started_at IS NOT NULL"
+                " ORDER BY id DESC LIMIT ?",
+                (STAGE_SENT, window)
+            ).fetchall()
+        finally:
+            conn.close()
+        return statistics.median(row['duration'] for row in rows) if rows else JOB_DEFAULT_DURATION
+
+    def renew(self, job_id, worker):
+        """Продлевает владение задачей; False, если задачу уже забрал другой обработчик."""
+        conn = self._connect()
+        try:
+            updated = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?",
+                (time.time() + self.lease_seconds, job_id, worker)
+            ).rowcount
+            conn.commit()
+            return bool(updated)
+        finally:
+            conn.close()
+
+    def checkpoint(self, job_id, stage=None, **fields):
+        """Сохраняет результаты стадии (и, если задана, новую стадию)."""
+        unknown = set(fields) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Неизвестные поля задачи: {', '.join(sorted(unknown))}")
+        if stage is not None:
+            # Счётчик попыток считает прерывания на текущей стадии
+            fields['stage'] = stage
+            fields['attempts'] = 0
+        fields['updated_at'] = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def cancel(self, job_id):
+        """
+        Отменяет задачу. Свободная задача завершается сразу ('cancelled'), у выполняемой выставляется флаг,
+        и обработчик прерывает её сам ('requested'). None — задача уже завершена.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            job = conn.execute("SELECT stage, lease_until FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None or job['stage'] not in ACTIVE_STAGES:
+                result = None
+            elif job['lease_until'] is None or job['lease_until'] < now:
+                conn.execute(
+                    "UPDATE jobs SET stage = ?, pdf = NULL, dossier = NULL, updated_at = ? WHERE id = ?",
+                    (STAGE_CANCELLED, now, job_id)
+                )
+                result = 'cancelled'
+            else:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+                result = 'requested'
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if result:
+            logger.info(f"Задача {job_id}: отмена ({result})")
+        return result
+
+    def cancel_requested(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return bool(row and row['cancel_requested'])
+        finally:
+            conn.close()
+
+    def active_jobs(self, chat_id, user_id):
+        """id незавершённых задач пользователя в чате."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE chat_id = ? AND user_id = ? AND stage IN ({_placeholders(ACTIVE_STAGES)})"
+                " ORDER BY id",
+                (chat_id, user_id, *ACTIVE_STAGES)
+            ).fetchall()
+            return [row['id'] for row in rows]
+        finally:
+            conn.close()
+
+    def release(self, job_id):
+        # Задача снова доступна для любого обработчика (например, при остановке бота).
+        # Штатно отпущенная задача не считается прерванной: попытку, списанную при claim, возвращаем,
+        # в JOB_MAX_ATTEMPTS идут только истёкшие lease (обработчик упал или завис)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET worker = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0) WHERE id = ?",
+                (job_id,)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def finish(self, job_id, stage, error=None):
+        # Большие промежуточные результаты завершённой задаче не нужны
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, error = ?, pdf = NULL, dossier = NULL,"
+                " worker = NULL, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (stage, error, now, job_id)
+            )
+            conn.execute(
+                f"DELETE FROM jobs WHERE stage IN ({', '.join('?' * len(FINISHED_STAGES))}) AND updated_at < ?",
+                (*FINISHED_STAGES, now - JOB_RETENTION)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class LLMSlots(SQLiteStore):
+    """
+    Места для запросов к Ollama, общие для всех процессов (бота и обработчиков) через тот же SQLite, что и очередь.
+    Место берётся во временное владение (lease) и продлевается, пока идёт генерация;
+    место упавшего процесса освобождается, когда lease истекает.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS llm_slots ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " holder TEXT NOT NULL,"
+        " lease_until REAL NOT NULL)",
+    )
+
+    def __init__(self, path=JOB_QUEUE_PATH, lease_seconds=JOB_LEASE_SECONDS):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+
+    def acquire(self, holder, limit):
+        """Занимает место, если занято меньше limit; возвращает id места или None."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM llm_slots WHERE lease_until < ?", (now,))
+            busy = conn.execute("SELECT COUNT(*) FROM llm_slots").fetchone()[0]
+            slot_id = None
+            if busy < limit:
+                slot_id = conn.execute(
+                    "INSERT INTO llm_slots (holder, lease_until) VALUES (?, ?)",
+                    (holder, now + self.lease_seconds)
+                ).lastrowid
+            conn.execute("COMMIT")
+            return slot_id
+        finally:
+            conn.close()
+
+    def renew(self, slot_id):
+        """Продлевает владение местом; False, если lease уже истёк и место отдано другим."""
+        conn = self._connect()
+        try:
+            updated = conn.execute(
+                "UPDATE llm_slots SET lease_until = ? WHERE id = ?", (time.time() + self.lease_seconds, slot_id)
+            ).rowcount
+            conn.commit()
+            return bool(updated)
+        finally:
+            conn.close()
+
+    def release(self, slot_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM llm_slots WHERE id = ?", (slot_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _row_to_dict(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+job_queue = JobQueue()
+llm_slots = LLMSlots()
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Кэш хранится отдельно от downloads/, чтобы /cleanfolder его не удалял
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.getcwd(), "cache"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_cache.sqlite"))
+# Максимальное число записей (лишние вытесняются по LRU) и время жизни записи в секундах
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+PREGENERATED_PATH = os.getenv("PREGENERATED_PATH", os.path.join(CACHE_DIR, "pregenerated.sqlite"))
+# Подстановка вместо имени в заранее сгенерированных текстах
+NAME_PLACEHOLDER = "[ИМЯ]"
+
+
+def template_hash(template):
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()
+
+
+class SQLiteStore:
+    """Базовый класс хранилища в локальном SQLite: схема создаётся при первом подключении."""
+
+    schema = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            conn.commit()
+            self._initialized = True
+        return conn
+
+
+class LLMCache(SQLiteStore):
+    """
+    Дисковый кэш ответов LLM в SQLite.
+    Ключ — модель, параметры генерации и SHA-256 полностью отрендеренного промпта.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS llm_cache ("
+        " key TEXT PRIMARY KEY,"
+        " section TEXT,"
+        " model TEXT,"
+        " response TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " accessed_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed_at)",
+        "CREATE INDEX IF NOT EXISTS llm_cache_section ON llm_cache(section)",
+    )
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL, enabled=LLM_CACHE_ENABLED):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+
+    @staticmethod
+    def make_key(model, options, prompt):
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps({"model": model, "options": options or {}, "prompt": prompt_hash}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return response
+        finally:
+            conn.close()
+
+    def put(self, key, section, model, response):
+        if not self.enabled:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, section, model, response, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, section, model, response, now, now)
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            # Вытесняем давно не использованные записи сверх лимита
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def invalidate_section(self, section):
+        if not self.enabled:
+            return 0
+        conn = self._connect()
+        try:
+            deleted = conn.execute("DELETE FROM llm_cache WHERE section = ?", (section,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info(f"Кэш LLM: удалено {deleted} записей для секции '{section}'")
+        return deleted
+
+
+class PregeneratedStore(SQLiteStore):
+    """
+    Заранее сгенерированные разделы (talents_resume, prof_resume) для частых комбинаций
+    талантов и типов деятельности. Текст хранится с NAME_PLACEHOLDER вместо имени.
+    Ключ комбинации — JSON-список талантов или типов в порядке вывода в досье;
+    template_hash — хэш шаблона вместе с моделью и параметрами генерации (pdf_processor.pregenerated_key).
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS combinations ("
+        " section TEXT NOT NULL,"
+        " combo_key TEXT NOT NULL,"
+        " hits INTEGER NOT NULL DEFAULT 0,"
+        " last_seen REAL NOT NULL,"
+        " PRIMARY KEY (section, combo_key))",
+        "CREATE TABLE IF NOT EXISTS pregenerated ("
+        " section TEXT NOT NULL,"
+        " combo_key TEXT NOT NULL,"
+        " template_hash TEXT NOT NULL,"
+        " text TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " PRIMARY KEY (section, combo_key, template_hash))",
+    )
+
+    def __init__(self, path=PREGENERATED_PATH):
+        super().__init__(path)
+
+    @staticmethod
+    def make_combo_key(items):
+        return json.dumps(list(items), ensure_ascii=False)
+
+    def record(self, section, combo_key):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO combinations (section, combo_key, hits, last_seen) VALUES (?, ?, 1, ?)"
+                " ON CONFLICT(section, combo_key) DO UPDATE SET hits = hits + 1, last_seen = excluded.last_seen",
+                (section, combo_key, time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, section, combo_key, tmpl_hash):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT text FROM pregenerated WHERE section = ? AND combo_key = ? AND template_hash = ?",
+                (section, combo_key, tmpl_hash)
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def put(self, section, combo_key, tmpl_hash, text):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO pregenerated (section, combo_key, template_hash, text, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (section, combo_key, tmpl_hash, text, time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def missing_combinations(self, section, tmpl_hash, limit):
+        """Самые частые комбинации секции, для которых ещё нет текста под текущий шаблон."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT c.combo_key FROM combinations c"
+                " LEFT JOIN pregenerated p ON p.section = c.section AND p.combo_key = c.combo_key"
+                "  AND p.template_hash = ?"
+                " WHERE c.section = ? AND p.combo_key IS NULL"
+                " ORDER BY c.hits DESC, c.last_seen DESC LIMIT ?",
+                (tmpl_hash, section, limit)
+            ).fetchall()
+            return [row[0] for row in rows]
+        finally:
+            conn.close()
+
+    def invalidate_section(self, section):
+        conn = self._connect()
+        try:
+            deleted = conn.execute("DELETE FROM pregenerated WHERE section = ?", (section,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if deleted:
+            logger.info(f"Предгенерация: удалено {deleted} текстов для секции '{section}'")
+        return deleted
+
+
+llm_cache = LLMCache()
+pregenerated_store = PregeneratedStore()
@@ -1,11 +1,22 @@
 import asyncio
+import json
 import os
 import logging
+import math
 import time
+from functools import partial
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, Chat
 from telegram.ext import ApplicationBuilder, CallbackQueryHandler, MessageHandler, filters, ContextTypes, CommandHandler
 import yaml
-from pdf_processor import process_pdf, load_prompts, save_prompts, reset_prompts, parse_and_cache_pdf, generate_all_resumes, create_pdf, get_pdf_output_path
+from pdf_processor import ollama, load_prompts, save_prompts, reset_prompts
+from executor import run_io, shutdown_pools, set_cpu_initializer, start_cpu_pool
+from job_queue import job_queue, STAGE_GENERATED
+from rate_limit import rate_limiter
+from dossier_jobs import start_workers, wake_workers, input_file_path, queue_status_text, JOB_WORKERS
+from job_progress import cancel_markup
+from renderer import warm_up
+from update_processor import ChatOrderedUpdateProcessor, MAX_CONCURRENT_UPDATES
+from pregenerate import pregenerate_loop, PREGENERATE_INTERVAL
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -13,6 +24,7 @@ logger = logging.getLogger(__name__)
 
 ADMINS_FILE = 'admins.yaml'
 DOWNLOADS_DIR = os.path.join(os.getcwd(), "downloads")
+RENDER_WARMUP = os.getenv("RENDER_WARMUP", "1") == "1"
 
 def load_admins():
     try:
@@ -32,14 +44,29 @@ def is_admin(user_id):
     admins = load_admins()
     return user_id in admins
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    isadmin = is_admin(user_id)
+MAIN_MENU_TEXT = "Выберите действие или отправьте PDF файл для обработки."
+EDIT_MENU_TEXT = "Выберите раздел для редактирования или нажмите ОК:"
+# Выполняемая задача может успеть дойти до отправки досье, поэтому отмену только подтверждаем
+CANCEL_REQUESTED_TEXT = "Отмена запрошена. Итог появится в сообщении о статусе обработки."
+
+def main_menu_markup(user_id):
     keyboard = [["Создать досье"]]
-    if isadmin:
+    if is_admin(user_id):
         keyboard[0].append("Команды")
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    text = "Выберите действие или отправьте PDF файл для обработки."
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+def edit_menu_markup():
+    keyboard = [
+        [InlineKeyboardButton("✏️ Редактировать профессиональные склонности", callback_data='edit_prof_resume')],
+        [InlineKeyboardButton("✏️ Редактировать скрытые таланты", callback_data='edit_talents_resume')],
+        [InlineKeyboardButton("✏️ Редактировать финальный вывод", callback_data='edit_final_resume')],
+        [InlineKeyboardButton("✅ ОК (редактировать не надо)", callback_data='edit_ok')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reply_markup = main_menu_markup(update.effective_user.id)
+    text = MAIN_MENU_TEXT
     if update.message:
         await update.message.reply_text(text, reply_markup=reply_markup)
     elif hasattr(update, "callback_query") and update.callback_query and update.callback_query.message:
@@ -48,65 +75,109 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_main_menu(update, context)
 
+async def check_rate_limit(update: Update, action):
+    # Дорогие операции ограничены по пользователю и чату; администраторы не ограничиваются
+    user_id = update.effective_user.id
+    if is_admin(user_id):
+        return True
+    wait = rate_limiter.acquire(action, user_id, update.effective_chat.id)
+    if not wait:
+        return True
+    await update.message.reply_text(
+        f"Слишком много запросов подряд. Пожалуйста, попробуйте снова через ~{max(1, math.ceil(wait / 60))} мин."
+    )
+    return False
+
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     document = update.message.document
     if document.mime_type != 'application/pdf':
         await update.message.reply_text("Пожалуйста, отправь PDF файл.")
         return
-    downloads_dir = os.path.join(os.getcwd(), "downloads")
-    os.makedirs(downloads_dir, exist_ok=True)
-    input_path = os.path.join(downloads_dir, f"{document.file_id}.pdf")
-    try:
-        file = await document.get_file()
-        await file.download_to_drive(custom_path=input_path)
-    except Exception as e:
-        logger.exception("Ошибка при скачивании файла")
-        await update.message.reply_text("Произошла ошибка при скачивании файла.")
+    if not await check_rate_limit(update, 'upload'):
         return
-    await update.message.reply_text("Обрабатываю файл, пожалуйста, подождите...")
-    try:
-        pdf_data = parse_and_cache_pdf(input_path)
-        context.user_data['pdf_data'] = pdf_data
-        prof_resume, talents_resume, final_resume = generate_all_resumes(pdf_data)
-        context.user_data['edit_pdf'] = {
-            'input_path': input_path,
-            'prof_resume': prof_resume,
-            'talents_resume': talents_resume,
-            'final_resume': final_resume
-        }
-        output_path = get_pdf_output_path(pdf_data['user_name'])
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        create_pdf(output_path, pdf_data, prof_resume, talents_resume, final_resume)
-        logger.info(f"Содержимое папки downloads перед отправкой: {os.listdir(downloads_dir)}")
-        logger.info(f"Путь к файлу для отправки: {output_path}")
-        logger.info(f"Файл существует? {os.path.exists(output_path)}")
-        if not os.path.exists(output_path):
-            logger.error(f"PDF не был создан: {output_path}")
-            await update.message.reply_text("Ошибка: PDF не был создан.")
-            return
-        with open(output_path, 'rb') as output_file:
-            await update.message.reply_document(document=output_file)
-        user_id = update.effective_user.id
-        if is_admin(user_id):
-            await show_edit_menu(update, context)
-        if update.message.chat.type == Chat.PRIVATE:
-            await show_main_menu(update, context)
-    except Exception as e:
-        logger.exception("Ошибка при обработке файла")
-        await update.message.reply_text("Произошла ошибка при обработке файла.")
-    # Не удаляем исходный файл, чтобы можно было пересоздавать PDF при редактировании
+    # Досье готовится в очереди задач: после перезапуска бота работа продолжается с последней стадии
+    job_id = await run_io(
+        job_queue.enqueue, 'upload', update.effective_chat.id, update.effective_user.id,
+        message_id=update.message.message_id, file_id=document.file_id, file_unique_id=document.file_unique_id
+    )
+    if job_id is None:
+        # Отклонённая выгрузка не расходует лимит пользователя
+        rate_limiter.refund('upload', update.effective_user.id, update.effective_chat.id)
+        await update.message.reply_text(
+            "Сейчас очень много заявок, и очередь заполнена. Пожалуйста, отправьте файл ещё раз через несколько минут."
+        )
+        return
+    status = await update.message.reply_text(await queue_status_text(job_id), reply_markup=cancel_markup(job_id))
+    await run_io(job_queue.checkpoint, job_id, status_message_id=status.message_id)
+    wake_workers()
+
+async def cancel_job(bot, job):
+    """
+    Отменяет задачу досье; результат — как у job_queue.cancel. Об отмене свободной задачи сразу сообщается
+    в её сообщении о статусе, а выполняемую прерывает обработчик, и итог (отмена или уже готовое досье)
+    он показывает в этом сообщении сам.
+    """
+    result = await run_io(job_queue.cancel, job['id'])
+    if result == 'cancelled' and job['status_message_id']:
+        try:
+            await bot.edit_message_text(chat_id=job['chat_id'], message_id=job['status_message_id'], text="Обработка отменена.")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение о статусе задачи {job['id']}: {e}")
+    return result
+
+async def cancel_job_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = query.from_user.id
+    job = await run_io(job_queue.get, int(query.data.split(':', 1)[1]))
+    if job is None or (job['user_id'] != user_id and not is_admin(user_id)):
+        await query.answer("Отменить обработку может только тот, кто отправил файл.", show_alert=True)
+        return
+    result = await cancel_job(context.bot, job)
+    if result is None:
+        await query.answer("Обработка уже завершена.")
+    elif result == 'requested':
+        await query.answer(CANCEL_REQUESTED_TEXT)
+    else:
+        await query.answer("Обработка отменена.")
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Отменяются все незавершённые задачи пользователя в этом чате, включая пересоздание после правки
+    job_ids = await run_io(job_queue.active_jobs, update.effective_chat.id, update.effective_user.id)
+    results = set()
+    for job_id in job_ids:
+        job = await run_io(job_queue.get, job_id)
+        if job is not None:
+            results.add(await cancel_job(context.bot, job))
+    if 'requested' in results:
+        await update.message.reply_text(CANCEL_REQUESTED_TEXT)
+    elif 'cancelled' in results:
+        await update.message.reply_text("Обработка отменена.")
+    else:
+        await update.message.reply_text("Сейчас нет файлов в обработке.")
+
+async def on_dossier_sent(application, job):
+    # Задача могла завершиться уже после перезапуска, поэтому работаем без update и context
+    user_id, chat_id = job['user_id'], job['chat_id']
+    if job['kind'] == 'edit':
+        await application.bot.send_message(chat_id=chat_id, text=f"Раздел '{job['section']}' обновлён и PDF пересоздан.")
+        await application.bot.send_message(chat_id=chat_id, text=EDIT_MENU_TEXT, reply_markup=edit_menu_markup())
+        return
+    user_data = application.user_data[user_id]
+    user_data['pdf_data'] = json.loads(job['pdf_data'])
+    user_data['edit_pdf'] = {
+        'input_path': input_file_path(job['file_id']),
+        'prof_resume': job['prof_resume'],
+        'talents_resume': job['talents_resume'],
+        'final_resume': job['final_resume']
+    }
+    if is_admin(user_id):
+        await application.bot.send_message(chat_id=chat_id, text=EDIT_MENU_TEXT, reply_markup=edit_menu_markup())
+    # В личном чате его id совпадает с id пользователя
+    if chat_id == user_id:
+        await application.bot.send_message(chat_id=chat_id, text=MAIN_MENU_TEXT, reply_markup=main_menu_markup(user_id))
 
 async def show_edit_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [InlineKeyboardButton("✏️ Редактировать профессиональные склонности", callback_data='edit_prof_resume')],
-        [InlineKeyboardButton("✏️ Редактировать скрытые таланты", callback_data='edit_talents_resume')],
-        [InlineKeyboardButton("✏️ Редактировать финальный вывод", callback_data='edit_final_resume')],
-        [InlineKeyboardButton("✅ ОК (редактировать не надо)", callback_data='edit_ok')]
-    ]
-    await update.message.reply_text(
-        "Выберите раздел для редактирования или нажмите ОК:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await update.message.reply_text(EDIT_MENU_TEXT, reply_markup=edit_menu_markup())
 
 async def edit_resume_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -198,20 +269,19 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     edit_pdf = context.user_data.get('edit_pdf')
     section = context.user_data.get('edit_section')
     if edit_pdf and section:
-        new_text = update.message.text
-        edit_pdf[section] = new_text
-        from pdf_processor import create_pdf, get_pdf_output_path
+        if not await check_rate_limit(update, 'edit'):
+            return
+        edit_pdf[section] = update.message.text
         pdf_data = context.user_data.get('pdf_data')
-        output_path = get_pdf_output_path(pdf_data['user_name'])
-        create_pdf(output_path, pdf_data, edit_pdf.get('prof_resume'), edit_pdf.get('talents_resume'), edit_pdf.get('final_resume'))
-        with open(output_path, 'rb') as output_file:
-            if not os.path.exists(output_path):
-                await update.message.reply_text("Ошибка: файл не найден для отправки.")
-                return
-            await update.message.reply_document(document=output_file)
-        await update.message.reply_text(f"Раздел '{section}' обновлён и PDF пересоздан.")
+        # Пересоздание досье идёт через общую очередь с наивысшим приоритетом и обгоняет выгрузки
+        await run_io(
+            job_queue.enqueue, 'edit', update.effective_chat.id, user_id, message_id=update.message.message_id,
+            stage=STAGE_GENERATED, section=section, pdf_data=json.dumps(pdf_data, ensure_ascii=False),
+            prof_resume=edit_pdf.get('prof_resume'), talents_resume=edit_pdf.get('talents_resume'),
+            final_resume=edit_pdf.get('final_resume')
+        )
+        wake_workers()
         context.user_data.pop('edit_section', None)
-        await show_edit_menu(update, context)
         return
     if not is_admin(user_id):
         await update.message.reply_text(f"Вашему ID {user_id} запрещён доступ. Только для администратора.")
@@ -357,6 +427,32 @@ async def admin_help_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()  # Закрыть спиннер
     await query.message.reply_text(get_admin_help_text())
 
+async def on_startup(application):
+    # Процессы рендеринга регистрируют шрифты один раз и по желанию делают пробный рендер.
+    # Пул процессов нужен, только если бот сам выполняет стадии задач (JOB_WORKERS > 0):
+    # иначе разбор и рендеринг идут в dossier_worker, и бот не тратит на пул память и время запуска
+    if RENDER_WARMUP:
+        set_cpu_initializer(warm_up)
+        if JOB_WORKERS > 0:
+            await start_cpu_pool()
+    # Фоновая предгенерация частых комбинаций, пока GPU простаивает
+    if PREGENERATE_INTERVAL > 0:
+        application.bot_data['pregenerate_task'] = asyncio.create_task(pregenerate_loop())
+    # Обработчики очереди досье; задачи, прерванные прошлым запуском, подхватываются сразу
+    application.bot_data['job_tasks'] = start_workers(application.bot, partial(on_dossier_sent, application))
+
+async def on_shutdown(application):
+    task = application.bot_data.pop('pregenerate_task', None)
+    if task:
+        task.cancel()
+    job_tasks = application.bot_data.pop('job_tasks', [])
+    for job_task in job_tasks:
+        job_task.cancel()
+    # Дожидаемся, пока обработчики освободят свои задачи для следующего запуска
+    await asyncio.gather(*job_tasks, return_exceptions=True)
+    await ollama.aclose()
+    shutdown_pools()
+
 def main():
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
@@ -365,12 +461,21 @@ def main():
     else:
         logger.info("Получен токен: %s...", token[:2])
 
-    application = ApplicationBuilder().token(token).build()
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     application.add_handler(MessageHandler(filters.Document.PDF, handle_document))
     # Сначала обработчики с pattern!
     application.add_handler(CallbackQueryHandler(admin_help_callback, pattern="^admin_help$"))
     application.add_handler(CallbackQueryHandler(edit_resume_callback, pattern='^edit_'))
+    application.add_handler(CallbackQueryHandler(cancel_job_callback, pattern=r'^cancel_job:\d+$'))
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("cancel", cancel_command))
     application.add_handler(CommandHandler("prompts", prompts_command))
     application.add_handler(CommandHandler("setprompt", setprompt_command))
     application.add_handler(CommandHandler("resetprompt", resetprompt_command))
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://llm_service:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "yandex/YandexGPT-5-Lite-8B-instruct-GGUF:latest")
+# Таймаут одного запроса генерации, секунды
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "600"))
+# Размер пула HTTP-соединений к Ollama
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+# Сколько модель держится в памяти GPU после запроса
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+class OllamaClient:
+    """
+    Тонкий асинхронный клиент для /api/generate Ollama.
+    Держит постоянную сессию httpx с пулом keep-alive соединений.
+    """
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, model=OLLAMA_MODEL, timeout=OLLAMA_TIMEOUT,
+                 max_connections=OLLAMA_MAX_CONNECTIONS, keep_alive=OLLAMA_KEEP_ALIVE, options=None):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self):
+        # httpx.AsyncClient привязан к event loop, в котором был создан
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._client_loop = loop
+        return self._client
+
+    def _payload(self, prompt, stream, options):
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        merged_options = {**self.options, **options}
+        if merged_options:
+            payload["options"] = merged_options
+        return payload
+
+    async def generate(self, prompt, timeout=None, **options):
+        """Возвращает полный ответ модели одной строкой."""
+        client = self._get_client()
+        response = await client.post(
+            "/api/generate",
+            json=self._payload(prompt, False, options),
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+        return response.json().get("response", "")
+
+    async def stream(self, prompt, timeout=None, **options):
+        """Асинхронный генератор фрагментов ответа по мере их генерации."""
+        client = self._get_client()
+        async with client.stream(
+            "POST",
+            "/api/generate",
+            json=self._payload(prompt, True, options),
+            timeout=timeout or self.timeout,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ошибка Ollama: {data['error']}")
+                chunk = data.get("response")
+                if chunk:
+                    yield chunk
+                if data.get("done"):
+                    break
+
+    def run_sync(self, coro):
+        """
+        Выполняет корутину в отдельном event loop (синхронные обёртки и CLI).
+        Клиент привязан к этому loop, поэтому закрывается вместе с ним, иначе пул соединений утекает.
+        """
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run())
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
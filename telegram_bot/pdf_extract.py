@@ -0,0 +1,196 @@
+import abc
+import glob
+import io
+import os
+import sys
+import logging
+import pdfplumber
+import pypdfium2 as pdfium
+from task_parser import clean_page_text, parse_pages, TASK_COUNT, TASK_HEADER_RE, NAME_RE
+
+logger = logging.getLogger(__name__)
+
+# Движок извлечения текста из PDF: pdfplumber (полная посимвольная разметка) или pdfium (только текст, быстрее)
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pdfplumber")
+# Предварительный проход pdfium по заголовкам заданий: полное извлечение только для нужных страниц
+PDF_INDEX_PASS = os.getenv("PDF_INDEX_PASS", "1") == "1"
+# Папка с образцами выгрузок для проверки совместимости движков
+PDF_SAMPLES_DIR = os.getenv("PDF_SAMPLES_DIR", os.path.join(os.getcwd(), "samples"))
+
+# Поля, которые должны совпадать у всех движков
+CONFORMANCE_FIELDS = ['user_name'] + [f'task{i}_parsed' for i in range(1, TASK_COUNT + 1)]
+
+
+class ExtractionBackend(abc.ABC):
+    """
+    Постранично извлекает сырой текст PDF. Очистка и разбор общие для всех движков.
+    Источник — путь к файлу или байты PDF (выгрузка, скачанная в память).
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def iter_page_texts(self, path, page_numbers=None):
+        # page_numbers — индексы страниц с нуля; None — все страницы
+        ...
+
+
+class PdfplumberBackend(ExtractionBackend):
+    name = "pdfplumber"
+
+    def iter_page_texts(self, path, page_numbers=None):
+        pages = [number + 1 for number in page_numbers] if page_numbers is not None else None
+        source = io.BytesIO(path) if isinstance(path, (bytes, bytearray)) else path
+        with pdfplumber.open(source, pages=pages) as pdf:
+            for page in pdf.pages:
+                page_text = page.extract_text()
+                # Освобождаем кэши разметки страницы сразу после извлечения
+                page.close()
+                yield page_text
+
+
+class PdfiumBackend(ExtractionBackend):
+    name = "pdfium"
+
+    def iter_page_texts(self, path, page_numbers=None):
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for index in (page_numbers if page_numbers is not None else range(len(pdf))):
+                page = pdf[index]
+                text_page = page.get_textpage()
+                page_text = text_page.get_text_range()
+                text_page.close()
+                page.close()
+                # pdfium разделяет строки через \r\n, pdfplumber — через \n
+                yield page_text.replace("\r\n", "\n").replace("\r", "\n")
+        finally:
+            pdf.close()
+
+
+BACKENDS = {backend.name: backend for backend in (PdfplumberBackend(), PdfiumBackend())}
+
+
+def get_backend(name=None):
+    name = name or PDF_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный движок извлечения текста PDF: {name} (доступны: {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+
+def iter_pdf_pages(path, backend=None, page_numbers=None):
+    """Постранично извлекает текст PDF выбранным движком и сразу очищает его."""
+    for page_text in get_backend(backend).iter_page_texts(path, page_numbers):
+        if page_text:
+            yield clean_page_text(page_text + "\n")
+
+
+def extract_pages(path, page_numbers, backend=None):
+    # Для пула процессов: очищенный текст указанных страниц
+    return list(iter_pdf_pages(path, backend, page_numbers))
+
+
+def count_pages(path):
+    # Число страниц без разбора содержимого (как и всё с pypdfium2 — не из пула потоков: PDFium не потокобезопасен)
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def index_task_headers(path):
+    """
+    Дешёвый проход pdfium без разметки: заголовки "Задание №N" в порядке документа.
+    Возвращает (список (номер задания или None для заголовка без точки, страница), число страниц,
+    есть ли имя ученика среди первых строк первой страницы).
+    """
+    headers = []
+    page_count = 0
+    name_on_first_page = False
+    for page_number, page_text in enumerate(BACKENDS["pdfium"].iter_page_texts(path)):
+        page_count += 1
+        page_text = clean_page_text(page_text)
+        if page_number == 0:
+            # Те же строки, среди которых имя ищет parse_user_info
+            lines = page_text.strip().splitlines()[:10]
+            name_on_first_page = any(NAME_RE.match(line.strip()) for line in lines)
+        for header in TASK_HEADER_RE.finditer(page_text):
+            number = header.group(1)
+            is_task = page_text.startswith(".", header.end()) and str(int(number)) == number
+            headers.append((int(number) if is_task else None, page_number))
+    return headers, page_count, name_on_first_page
+
+
+def select_task_pages(path, backend=None):
+    """
+    Страницы, нужные для разбора: первая (имя ученика) и от первого заголовка задания
+    до конца блоков всех заданий 1..TASK_COUNT. None — извлекать все страницы.
+    """
+    if not PDF_INDEX_PASS or get_backend(backend).name == "pdfium":
+        # Для pdfium отдельный проход не дешевле самого извлечения
+        return None
+    headers, page_count, name_on_first_page = index_task_headers(path)
+    first = {}
+    for position, (number, page_number) in enumerate(headers):
+        if number is not None and number not in first:
+            first[number] = position
+    if any(number not in first for number in range(1, TASK_COUNT + 1)):
+        # Заголовок мог разрезаться границей страницы — надёжнее извлечь всё
+        return None
+    positions = [first[number] for number in range(1, TASK_COUNT + 1)]
+    start = min(headers[position][1] for position in positions)
+    # Блок задания заканчивается на странице следующего заголовка (или на последней странице)
+    end = max(
+        headers[position + 1][1] if position + 1 < len(headers) else page_count - 1
+        for position in positions
+    )
+    if not name_on_first_page:
+        # Имени на первой странице нет (например, титульный лист): parse_user_info найдёт его дальше,
+        # поэтому страницы до первого задания извлекаются все, как при полном извлечении
+        start = 0
+    page_numbers = sorted({0, *range(start, end + 1)})
+    if len(page_numbers) == page_count:
+        return None
+    logger.info(f"Извлекаются страницы {len(page_numbers)} из {page_count}")
+    return page_numbers
+
+
+def check_conformance(paths, reference="pdfplumber"):
+    """
+    Разбирает каждую выгрузку всеми движками и сравнивает результаты с эталонным.
+    Эталонный движок проверяется и с предварительным поиском страниц (PDF_INDEX_PASS) — как "<движок>+index".
+    Возвращает список расхождений (файл, движок, поле).
+    """
+    mismatches = []
+    for path in paths:
+        expected = parse_pages(iter_pdf_pages(path, reference))
+        variants = {name: iter_pdf_pages(path, name) for name in BACKENDS if name != reference}
+        page_numbers = select_task_pages(path, reference)
+        if page_numbers is not None:
+            variants[f"{reference}+index"] = iter_pdf_pages(path, reference, page_numbers)
+        for name, pages in variants.items():
+            actual = parse_pages(pages)
+            for field in CONFORMANCE_FIELDS:
+                if actual[field] != expected[field]:
+                    mismatches.append((path, name, field))
+    return mismatches
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Аргументы — файлы или папки с выгрузками; по умолчанию PDF_SAMPLES_DIR
+    paths = []
+    for arg in sys.argv[1:] or [PDF_SAMPLES_DIR]:
+        paths.extend(sorted(glob.glob(os.path.join(arg, "*.pdf"))) if os.path.isdir(arg) else [arg])
+    if not paths:
+        logger.error("Не найдено ни одной выгрузки для проверки")
+        sys.exit(1)
+    mismatches = check_conformance(paths)
+    for path, name, field in mismatches:
+        logger.error(f"{os.path.basename(path)}: движок {name} расходится с pdfplumber в поле {field}")
+    logger.info(f"Проверено выгрузок: {len(paths)}, расхождений: {len(mismatches)}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,622 +1,61 @@
-import subprocess
-from langchain_ollama import OllamaLLM
+import asyncio
+import contextlib
+import io
+import socket
 from pathlib import Path
-import pdfplumber
-import re
-import logging
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable, Flowable
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.units import cm
-from reportlab.lib import colors
 import os
-from emojipy import Emoji
+import logging
 import yaml
-from reference_data import types_info, hidden_talents_info, personality_info, orientations
-
+import json
+from ollama_client import OllamaClient
+from llm_cache import llm_cache, pregenerated_store, template_hash, NAME_PLACEHOLDER
+from executor import run_io, run_cpu, CPU_POOL_SIZE
+from emoji_store import emoji_to_pdf_markup, install_image_cache
+from renderer import render_dossier, EMOJI_FONT_SIZE
+from task_parser import parse_pages
+from pdf_extract import iter_pdf_pages, extract_pages, count_pages, select_task_pages
+from activity_scoring import activity_scorer
+from dossier_store import dossier_store
+from job_queue import llm_slots
+from fragments import make_fragment, join_raw, join_pdf, prof_fragment, talent_fragment, personality_fragment, orientation_fragment, ORIENTATIONS_INTRO
+
+logger = logging.getLogger(__name__)
 # Подавляем предупреждения pdfminer
 logging.getLogger("pdfminer").setLevel(logging.ERROR)
-ollama = OllamaLLM(base_url="http://llm_service:11434", model="yandex/YandexGPT-5-Lite-8B-instruct-GGUF:latest")
+install_image_cache()
+ollama = OllamaClient()
+# Сколько запросов Ollama обрабатывает параллельно (должно совпадать с OLLAMA_NUM_PARALLEL сервера):
+# лимит общий для всех процессов, которые работают с одной очередью задач (cache/jobs.sqlite)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "2"))
+# Как часто ждущий запрос проверяет, не освободилось ли место у Ollama, секунды
+LLM_SLOT_POLL = float(os.getenv("LLM_SLOT_POLL", "0.5"))
+# Выгрузки от стольких страниц извлекаются по диапазонам в нескольких процессах (0 — всегда в одном)
+PARALLEL_EXTRACT_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACT_MIN_PAGES", "12"))
 
 # Используемые функции
 
-def extract_text_from_pdf(path):
-    text = ""
-    with pdfplumber.open(path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    return text
-
-def clean_text(text):
-    # Удаляем ссылки вида:
-    # "https://bot.youcan.by/admin/info/user/<число>/" с опциональным номером страницы типа "18/20"
-    text = re.sub(
-        r"(https?://)?bot\.youcan\.by/admin/info/user/\d+/\s*\d+/\d+",
-        "",
-        text
-    )
-    # Удаляем ссылки вида "https://bot.youcan.by/admin/info/user/<число>/"
-    text = re.sub(
-        r"(https?://)?bot\.youcan\.by/admin/info/user/\d+/",
-        "",
-        text
-    )
-    # Удаляем дату и время в формате "23 сентября 2024 г. 12:02", "23.09.2024, 12:58" и "2024-09-23 12:03:45"
-#    text = re.sub(r"\d{1,2} (?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря) \d{4} г?\.? \d{1,2}:\d{2}", "", text)
-    text = re.sub(r"\d{1,2}\.\d{1,2}\.\d{4},? \d{1,2}:\d{2}", "", text)
-    text = re.sub(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}", "", text)
-    # Удаляем номера страниц в формате "18/20"
-    text = re.sub(r"\d+/\d+", "", text)
-    # Удаляем фразу "Тест пройден:"
-#    text = re.sub(r"Тест пройден:\s*", "", text)
-    return text.strip()
-
-def parse_user_info(text):
-    lines = text.strip().splitlines()
-    name_pattern = re.compile(r"^[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)+$")
-    for line in lines[:10]:
-        candidate = line.strip()
-        if name_pattern.match(candidate):
-            return candidate
-    return lines[0].strip() if lines else ""
-
-def get_task_body(task_text):
-    """
-    Из блока задания возвращает содержимое после строки, содержащей "Тест пройден:"
-    (то есть пропускает заголовок с датой и временем).
-    """
-    pattern = re.compile(r"Тест пройден:\s*\n.*?\n(.*)", re.DOTALL)
-    m = pattern.search(task_text)
-    if m:
-        return m.group(1).strip()
-    else:
-        return task_text.strip()
-
-def extract_task(text, task_number):
-    # Извлекаем блок от "Задание №<task_number>" до следующего "Задание №" или конца текста,
-    # затем возвращаем содержимое после строки с "Тест пройден:".
-    pattern = re.compile(rf"(Задание\s*№{task_number}\..*?)(?=Задание\s*№\d+|$)", re.DOTALL)
-    match = pattern.search(text)
-    if match:
-        task_block = match.group(1)
-        return get_task_body(task_block)
-    else:
-        return ""
-
-def parse_task1(task_text):
-    pattern = re.compile(r"(\d+)\.\s*(.+?)\s*💡.*?Количество баллов:\s*(\d+)", re.DOTALL)
-    results = pattern.findall(task_text)
-    parsed = []
-    header = "профессиональные склонности"
-    for num, description, points in results:
-        normalized = " ".join(description.split()).lower()
-        if normalized == header:
-            continue
-        parsed.append({
-            "пункт": int(num),
-            "описание": description.strip(),
-            "баллы": int(points)
-        })
-    # Удаляем переносы строк в значениях словаря перед возвратом
-    for item in parsed:
-        item['описание'] = item['описание'].replace('\n', ' ').replace('\r', '')
-    return parsed
-
-
-def parse_task2(task_text):
-    pattern = re.compile(r"(.+\(\w+\))", re.DOTALL)
-    m = pattern.search(task_text)
-    result = m.group(1).strip() if m else ""
-    # Удаляем переносы строк перед возвратом
-    return result.replace('\n', '<br/>').replace('\r', '')
-
-
-def parse_task2(task_text):
-    pattern = re.compile(r"(.+\(\w+\))", re.DOTALL)
-    m = pattern.search(task_text)
-    result = m.group(1).strip() if m else ""
-    # Удаляем переносы строк перед возвратом
-    return task_text.replace('\n', '<br/>').replace('\r', '')
-
-def parse_task3(task_text):
-    pattern = re.compile(r"(\d+)\.\s*(.+?)\s*💡.*?Количество баллов:\s*(\d+)", re.DOTALL)
-    results = pattern.findall(task_text)
-    parsed = []
-    header = "профессиональный тип личности"
-    for num, description, points in results:
-        normalized = " ".join(description.split()).lower()
-        if normalized == header:
-            continue
-        parsed.append({
-            "пункт": int(num),
-            "описание": description.strip(),
-            "баллы": int(points)
-        })
-    # Удаляем переносы строк в значениях словаря перед возвратом
-    for item in parsed:
-        if isinstance(item['описание'], str):
-            item['описание'] = item['описание'].replace('\n', ' ').replace('\r', '')
-    return parsed
-
-def parse_task4(task_text):
-    pattern = re.compile(
-        r"(\d+)\.\s*(.+?)(?=\s+[А-ЯЁ])(?:.*?Количество баллов:\s*(\d+))",
-        re.DOTALL
-    )
-    header = "ценностные ориентиры"
-    results = pattern.findall(task_text)
-    parsed = [
-        {
-            "описание": " ".join(description.split()),
-            "баллы": int(points)
-        }
-        for num, description, points in results
-        if " ".join(description.split()).lower() != header
-    ]
-    # Сортировка по количеству баллов (от большего к меньшему)
-    return sorted(parsed, key=lambda x: x["баллы"], reverse=True)
-
-
-def parse_task5(task_text):
-    pattern = re.compile(r"Ответ\s*(.*?)\s*(?=(Задание\s*№|Вопрос\s*№|$))", re.DOTALL)
-    match = pattern.search(task_text)
-    result = match.group(1).strip() if match else ""
-    # Удаляем переносы строк перед возвратом
-    return result.replace('\n', ' ').replace('\r', '')
-
-def parse_task6(task_text):
-    pattern = re.compile(r'Ответ\s*(.*?)\s*(?=(Вопрос\s*№\d+|$))', re.DOTALL)
-    matches = pattern.findall(task_text)
-    # Очищаем и возвращаем список ответов
-    return [match[0].replace('\n', ' ').replace('\r', '') for match in matches]
-
-def parse_task7(task_text):
-    pattern = re.compile(r"Ответ\s*(.*?)\s*(?=(Задание\s*№|Вопрос\s*№|$))", re.DOTALL)
-    match = pattern.search(task_text)
-    result = match.group(1).strip() if match else ""
-    # Удаляем переносы строк перед возвратом
-
-    return result.replace('\n', '<br/>').replace('\r', '<br/>')
-
-def parse_task8(task_text):
-    date_pattern = re.compile(r"\d{1,2}\.\d{1,2}\.\d{4},\s*\d{1,2}:\d{2}")
-    date_match = date_pattern.search(task_text)
-    if date_match:
-        start_index = date_match.end()
-        remaining_text = task_text[start_index:]
-    else:
-        remaining_text = task_text
-
-    lines = remaining_text.splitlines()
-    filtered_lines = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        if re.search(r"(https?://|www\.)", line) or re.search(r"\d+/\d+", line):
-            continue
-        words = line.split()
-        if 1 <= len(words) <= 2 and all(re.fullmatch(r"[А-ЯЁа-яё]+", word) for word in words):
-            filtered_lines.append(line)
-    return filtered_lines
-
 def replace_with_emoji_pdf(text, size):
-    # Конвертируем эмодзи в HTML-теги <img>
-    text = Emoji.to_image(text)
-    # Задаем размеры: указываем явно маленькие значения (size в пикселях)
-    text = re.sub(r'class="[^"]*"', '', text)  # удаляем атрибут class
-    text = re.sub(r'style="[^"]*"', '', text)   # удаляем атрибут style
-    text = re.sub(r'alt="[^"]*"', '', text)       # удаляем alt
-    # Добавляем атрибуты width и height с нужными значениями:
-    # можно выбрать size в зависимости от нужного масштаба (например, 14)
-    text = re.sub(r'<img', f'<img height="{size}" width="{size}"', text)
-    return text
+    # Конвертируем эмодзи в HTML-теги <img> с локальными файлами
+    return emoji_to_pdf_markup(text, size)
 
 
- ###########################################################   
+###########################################################
 
 def process_pdf(input_pdf_path: str, custom_prof_resume=None, custom_talents_resume=None, custom_final_resume=None) -> str:
     """
     Обрабатывает входной PDF, вызывает модель через Ollama,
     генерирует новый PDF (например, dossier.pdf) и возвращает путь к нему.
     """
-    # Извлечение текста из PDF
-    text = extract_text_from_pdf(input_pdf_path)
-    text = clean_text(text)
-    user_name = parse_user_info(text)
-
-    tasks = {}
-    for i in range(1, 9):
-        task_text = extract_task(text, i)
-        tasks[f"Задание №{i}"] = task_text.strip()
-
-    # Задание №1-8
-    task1_parsed = parse_task1(tasks.get("Задание №1", ""))
-    task2_parsed = parse_task2(tasks.get("Задание №2", ""))
-    task3_parsed = parse_task3(tasks.get("Задание №3", ""))
-    task4_parsed = parse_task4(tasks.get("Задание №4", ""))
-    task5_parsed = parse_task5(tasks.get("Задание №5", ""))
-    task6_parsed = parse_task6(tasks.get("Задание №6", ""))
-    task7_parsed = parse_task7(tasks.get("Задание №7", ""))
-    task8_parsed = parse_task8(tasks.get("Задание №8", ""))
-
-    # Профессиональные склонности
-    # Правила сопоставления (поиск подстрок в описании)
-    mappings = [
-        ({"task1": "работе с людьми", "task3": "социальный"}, "Социальный"),
-        ({"task1": "эстетическ", "task3": "артистичный"}, "Артистический"),
-        ({"task1": "работы с информацией", "task3": "консервативный"}, "Информационный"),
-        ({"task1": "практической", "task3": "практический"}, "Практический"),
-        ({"task1": "экстремальн"}, "Экстремальный"),
-        ({"task1": "исследовательской", "task3": "интеллектуальный"}, "Интеллектуальный"),
-        ({"task3": "инициативный"}, "Инициативный")
-    ]
-
-    # Функция для проверки наличия подстроки (без учета регистра)
-    def match(description, substr):
-        return substr.lower() in description.lower()
-
-    # Словарь для суммирования баллов по каждому типу
-    scores = {}
-
-    # Расчет баллов по правилам
-    for rule, type_name in mappings:
-        total = 0
-        # Если правило содержит оба условия: task1 и task3
-        if "task1" in rule and "task3" in rule:
-            for t1 in task1_parsed:
-                if match(t1["описание"], rule["task1"]):
-                    for t3 in task3_parsed:
-                        if match(t3["описание"], rule["task3"]):
-                            total += t1["баллы"] + t3["баллы"]
-        # Если правило задано только для task1
-        elif "task1" in rule:
-            for t1 in task1_parsed:
-                if match(t1["описание"], rule["task1"]):
-                    total += t1["баллы"]
-        # Если правило задано только для task3
-        elif "task3" in rule:
-            for t3 in task3_parsed:
-                if match(t3["описание"], rule["task3"]):
-                    total += t3["баллы"]
-        if total > 0:
-            scores[type_name] = scores.get(type_name, 0) + total
-
-    # Сортировка типов по убыванию баллов
-    sorted_types = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-    # Функция для форматирования строки с баллами
-    def format_score(score):
-        if 11 <= score % 100 <= 19:
-            return f"{score} баллов"
-        else:
-            last_digit = score % 10
-            if last_digit == 1:
-                return f"{score} балл"
-            elif last_digit in [2, 3, 4]:
-                return f"{score} балла"
-            else:
-                return f"{score} баллов"
-
-    # Собираем итоговый текст профиля с единым оформлением и emoji
-    aggregated_text_prof = ""
-    for type_name, score in sorted_types:
-        aggregated_text_prof += f"<br/>👉 <b>{type_name} тип деятельности:</b><br/>"
-        if type_name in types_info:
-            info = types_info[type_name]
-            aggregated_text_prof += f"📝 {info['description']}<br/>"
-            aggregated_text_prof += "💼 Подходящие профессии:<br/>"
-            for prof in info["professions"]:
-                aggregated_text_prof += f"   ✔️ {prof}<br/>"
-
-    # Формирование prompt для генерации резюме по разделу "Профессиональные склонности".
-    prompts = load_prompts()
-    if custom_prof_resume is not None:
-        prof_resume = custom_prof_resume
-    else:
-        prompt_prof = prompts['prof_resume']['template'].format(
-            user_name=user_name,
-            aggregated_text_prof=aggregated_text_prof
-        )
-    prof_resume = ollama.invoke(prompt_prof)
-
-    # Личностные особенности
-    # Функция для извлечения кода личности из строки (находим содержимое в скобках)
-    def extract_personality(code_str):
-        start = code_str.find("(")
-        end = code_str.find(")")
-        if start != -1 and end != -1:
-            return code_str[start+1:end].strip()
-        return None
-
-    personality_code = extract_personality(task2_parsed)
-
-    # Собираем информацию по типу личности в формате списка
-    aggregated_text_personality = ""
-    if personality_code and personality_code in personality_info:
-        info = personality_info[personality_code]
-        aggregated_text_personality += f"<br/><br/>🎭 Тип личности: {info['name']}<br/>"
-        aggregated_text_personality += f"📝 {info['description']}<br/><br/>"
-        aggregated_text_personality += "🚀 Давай разберём, что делает тебя таким особенным:<br/><br/>"
-        for feature in info["features"]:
-            aggregated_text_personality += f"🔑 {feature['feature']}:<br/>"
-            aggregated_text_personality += f"📝 {feature['description']}<br/>"
-            aggregated_text_personality += f"💡 {feature['examples']}<br/><br/>"
-    else:
-        aggregated_text_personality = task2_parsed
-
-    # Ценностные ориентиры
-    # Функция для сборки итогового текста для ценностных ориентиров
-    def build_orientations_text(task_results, orientations):
-        aggregated_text_orientations = "Твои ценностные ориентиры помогают тебе понять, что действительно важно для тебя в жизни и карьере. Реализуя их, ты можешь чувствовать себя максимально успешным и гармоничным в своей профессии. <br/> Давай разберём, что значит каждая из них и как они могут реализоваться:"
-        for result in task_results:
-            desc = result['описание']
-            data = orientations.get(desc)
-            if data:
-                aggregated_text_orientations += (
-                    f"<br/>💡{data['ориентир']}<br/>"
-                    f"📝{data['описание']}<br/>"
-                    "✔️ Какой путь тебе подойдет?<br/>"
-                    f"{data['путь']}<br/>"
-                )
-            else:
-                aggregated_text_orientations += f"<br/><br/>❗ Нет данных для описания: {desc}<br/>"
-        return aggregated_text_orientations
-
-
-    # Получаем итоговый текст для ценностных ориентиров
-    aggregated_text_orientations = build_orientations_text(task4_parsed, orientations)
-
-    # Скрытые таланты
-    # Собираем информацию по каждому таланту в единый формат
-    aggregated_text_talents = ""
-    for talent in task8_parsed:
-        info = hidden_talents_info.get(talent)
-        if info:
-            aggregated_text_talents += f"<br/>✨ {talent}:<br/>"
-            aggregated_text_talents += f"📝 {info['description']}<br/><br/>"
-            aggregated_text_talents += "💡 Примеры реализации:<br/>"
-            aggregated_text_talents += f"{info['examples']}<br/>"
-        else:
-            aggregated_text_talents += f"<br/><br/>❗ Информация по таланту «{talent}» не найдена.<br/><br/>"
-
-    # Формирование prompt для генерации резюме по разделу "Скрытые таланты".
-    if custom_talents_resume is not None:
-        talents_resume = custom_talents_resume
-    else:
-        prompt_talents = prompts['talents_resume']['template'].format(
-            user_name=user_name,
-            aggregated_text_talents=aggregated_text_talents
-        )
-    talents_resume = ollama.invoke(prompt_talents)
-
-    # Приветствие
-    if custom_final_resume is not None:
-        resume = custom_final_resume
-    else:
-        prompt_final = prompts['final_resume']['template'].format(
-            user_name=user_name,
-            aggregated_text_prof=aggregated_text_prof,
-            prof_resume=prof_resume,
-            aggregated_text_personality=aggregated_text_personality,
-            aggregated_text_orientations=aggregated_text_orientations,
-            aggregated_text_talents=aggregated_text_talents,
-            talents_resume=talents_resume
-        )
-    resume = ollama.invoke(prompt_final)
-
-    # Формирование PDF
-    # Путь к шрифту Symbola
-    mulish_regular_path = 'Mulish-Regular.ttf'
-    if not os.path.exists(mulish_regular_path):
-        raise FileNotFoundError(f"Файл шрифта '{mulish_regular_path}' не найден.")
-
-    # Путь к шрифту M PLUS Rounded 1c Bold
-    mplus_bold_path = 'MPLUSRounded1c-ExtraBold.ttf'
-    if not os.path.exists(mplus_bold_path):
-        raise FileNotFoundError(f"Файл шрифта '{rounded_b_font_path}' не найден.")
-
-    # Регистрация шрифтов
-    pdfmetrics.registerFont(TTFont('Mulish-Regular', mulish_regular_path))
-    pdfmetrics.registerFont(TTFont('MPlusRounded1cB', mplus_bold_path))
-
-    # Имя PDF-файла
-    # Определяем путь к директории "downloads" в текущей рабочей директории
-    downloads_dir = Path.cwd() / "downloads"
-    # Формируем путь к выходному PDF-файлу с использованием кириллических символов в имени
-    output_pdf_path = str(downloads_dir / f"Досье {user_name}.pdf")
-
-    # Увеличиваем верхний отступ на высоту header (3 см) + дополнительное пространство, например, 40
-    doc = SimpleDocTemplate(output_pdf_path,
-                            pagesize=A4,
-                            rightMargin=40,
-                            leftMargin=40,
-                            topMargin=3*cm + 40,
-                            bottomMargin=40)
-
-
-    # Настройка стилей
-    styles = getSampleStyleSheet()
-    # Основной текст
-    styles['Normal'].fontName = 'Mulish-Regular'
-    styles['Normal'].fontSize = 14
-    styles['Normal'].leading = 16
-
-    # Заголовки блоков
-    styles['Heading2'].fontName = "MPlusRounded1cB"
-    styles['Heading2'].fontSize = 16
-    styles['Heading2'].leading = 20
-
-    # Стиль для заголовка документа – используем жирный шрифт
-    title_style = ParagraphStyle(
-        'Title',
-        parent=styles['Heading2'],
-        fontSize=28,
-        alignment=1,  # по центру
-        spaceAfter=16,
-    )
-
-    # Стиль для названий блоков
-    block_header_style = ParagraphStyle(
-        'BlockHeader',
-        parent=styles['Heading2'],
-        fontSize=18,
-        spaceAfter=8,
-    )
-
-    normal_style = styles['Normal']
-
-    # Класс для оборачивания текста с пунктирной рамкой и закруглёнными углами
-    class RoundedBorderedParagraph(Flowable):
-        def __init__(self, text, style, padding=0.5*cm, radius=10, dash=(3, 3)):
-            Flowable.__init__(self)
-            self.text = text
-            self.style = style
-            self.padding = padding
-            self.radius = radius
-            self.dash = dash
-            self.paragraph = Paragraph(text, style)
-            self.width = 0
-            self.height = 0
-
-        def wrap(self, availWidth, availHeight):
-            # Доступная ширина для текста – с учётом отступов
-            available_text_width = availWidth - 2 * self.padding
-            w, h = self.paragraph.wrap(available_text_width, availHeight - 2 * self.padding)
-            self.width = w + 2 * self.padding
-            self.height = h + 2 * self.padding
-            return self.width, self.height
-
-        def draw(self):
-            # Рисуем пунктирную рамку с закруглёнными углами
-            self.canv.saveState()
-            self.canv.setStrokeColor(colors.HexColor('#f8bb42'))
-            self.canv.setLineWidth(1)
-            self.canv.setDash(self.dash[0], self.dash[1])
-            self.canv.roundRect(0, 0, self.width, self.height, self.radius, stroke=1, fill=0)
-            self.canv.restoreState()
-            # Рисуем текст с отступом (padding)
-            self.paragraph.drawOn(self.canv, self.padding, self.padding)
-
-        def split(self, availWidth, availHeight):
-            """
-            Если содержимое не помещается, разбиваем Paragraph на несколько частей.
-            Каждый элемент списка – новый RoundedBorderedParagraph, подходящий для текущей области.
-            """
-            available_text_width = availWidth - 2 * self.padding
-            available_text_height = availHeight - 2 * self.padding
-            # Используем встроенный метод split у Paragraph
-            split_paragraphs = self.paragraph.split(available_text_width, available_text_height)
-            if not split_paragraphs:
-                return []
-            flowables = []
-            for p in split_paragraphs:
-                new_flowable = RoundedBorderedParagraph("", self.style, self.padding, self.radius, self.dash)
-                new_flowable.paragraph = p
-                w, h = p.wrap(available_text_width, available_text_height)
-                new_flowable.width = w + 2 * self.padding
-                new_flowable.height = h + 2 * self.padding
-                flowables.append(new_flowable)
-            return flowables
-
-    # Кастомный Flowable для пунктирной линии под заголовками блоков
-    class DashedHRFlowable(Flowable):
-        def __init__(self, width, thickness=1):
-            Flowable.__init__(self)
-            self.width = width
-            self.thickness = thickness
-
-        def wrap(self, availWidth, availHeight):
-            return self.width, self.thickness
-
-        def draw(self):
-            self.canv.saveState()
-            self.canv.setStrokeColor(colors.HexColor('#f8bb42'))
-            self.canv.setLineWidth(self.thickness)
-            self.canv.setDash(3, 3)  # 3 пункта линия, 3 пункта пробел
-            self.canv.line(0, self.thickness/2.0, self.width, self.thickness/2.0)
-            self.canv.restoreState()
-
-    # Функция для добавления блока с заголовком, линией и текстом с рамкой
-    def add_block(title, text_content, story):
-        story.append(Paragraph(title, block_header_style))
-        story.append(Spacer(1, 14))
-        bordered_paragraph = RoundedBorderedParagraph(text_content, normal_style)
-        story.append(bordered_paragraph)
-        story.append(Spacer(1, 24))
-
-    # Функция для добавления верхнего колонтитула на каждой странице
-    def header(canvas, doc):
-        width, height = A4
-        header_height = 3 * cm
-        canvas.saveState()
-        # Рисуем жёлтую полосу с цветом #f8bb42
-        canvas.setFillColor(colors.HexColor('#f8bb42'))
-        canvas.rect(0, height - header_height, width, header_height, stroke=0, fill=1)
-
-        # Параметры логотипа
-        logo_path = "logo.png"  
-        logo_width = 2.5 * cm
-        logo_height = 2.5 * cm
-        logo_x = 1 * cm  # отступ от левого края
-        logo_y = height - header_height + (header_height - logo_height) / 2.0
-        canvas.drawImage(logo_path, logo_x, logo_y,
-                        width=logo_width, height=logo_height,
-                        preserveAspectRatio=True, mask='auto')
-
-        # Параметры текста, располагаемого рядом с логотипом
-        text_lines = ["Помогаем реализовывать", "твои таланты"]
-        text_font = "MPlusRounded1cB"
-        text_size = 20
-        text_color = colors.black
-        text_x = logo_x + logo_width + 0.5 * cm  # отступ от логотипа
-        total_text_height = 2 * text_size + 2
-        text_y = height - header_height + (header_height + total_text_height) / 2.0 - text_size
-
-        canvas.setFont(text_font, text_size)
-        canvas.setFillColor(text_color)
-        for line in text_lines:
-            canvas.drawString(text_x, text_y, line)
-            text_y -= text_size + 2
-        canvas.restoreState()
-
-
-    # Сбор элементов документа
-    story = []
-
-
-    # Определяем размер эмодзи в зависимости от стиля (например, размер основного текста)
-    emoji_font_size = normal_style.fontSize  # здесь 14, согласно настройкам
-
-    # Преобразуем текстовые переменные:
-    resume = replace_with_emoji_pdf(resume, emoji_font_size)
-    aggregated_text_prof = replace_with_emoji_pdf(aggregated_text_prof, emoji_font_size)
-    prof_resume = replace_with_emoji_pdf(prof_resume, emoji_font_size)
-    aggregated_text_personality = replace_with_emoji_pdf(aggregated_text_personality, emoji_font_size)
-    aggregated_text_orientations = replace_with_emoji_pdf(aggregated_text_orientations, emoji_font_size)
-    aggregated_text_talents = replace_with_emoji_pdf(aggregated_text_talents, emoji_font_size)
-    talents_resume = replace_with_emoji_pdf(talents_resume, emoji_font_size)
-
-
-    # Заголовок документа
-    story.append(Paragraph("ПРОФДИЗАЙН", title_style))
-    story.append(DashedHRFlowable(doc.width, thickness=1))
-    story.append(Spacer(1, 24))
-    story.append(Paragraph(resume, normal_style))
-    story.append(Spacer(1, 24))
-
-    # Добавление блоков документа с рамками
-    add_block("Профессиональные склонности", aggregated_text_prof + "<br/><br/>" + prof_resume, story)
-    add_block("Личностные особенности", aggregated_text_personality, story)
-    add_block("Ценностные ориентиры", aggregated_text_orientations, story)
-    add_block("Скрытые таланты", aggregated_text_talents + "<br/><br/>" + talents_resume, story)
-
-    # Создание PDF-файла с автоматическим разбиением на страницы и добавлением колонтитула
-    doc.build(story, onFirstPage=header, onLaterPages=header)
+    pdf_data = parse_and_cache_pdf(input_pdf_path)
+    prof_resume, talents_resume, resume = ollama.run_sync(agenerate_all_resumes(
+        pdf_data,
+        custom_prof_resume=custom_prof_resume,
+        custom_talents_resume=custom_talents_resume,
+        custom_final_resume=custom_final_resume
+    ))
+    output_pdf_path = get_pdf_output_path(pdf_data['user_name'])
+    os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
+    create_pdf(output_pdf_path, pdf_data, prof_resume, talents_resume, resume)
     return output_pdf_path, prof_resume, talents_resume, resume
 
 PROMPTS_PATH = 'prompts.yaml'
@@ -627,8 +66,35 @@ def load_prompts():
         return yaml.safe_load(f)
 
 def save_prompts(prompts):
+    try:
+        old_prompts = load_prompts() or {}
+    except FileNotFoundError:
+        old_prompts = {}
     with open(PROMPTS_PATH, 'w', encoding='utf-8') as f:
         yaml.safe_dump(prompts, f, allow_unicode=True)
+    # Сбрасываем кэш LLM и предгенерированные тексты для секций, шаблон которых изменился
+    changed = False
+    for section, value in prompts.items():
+        if old_prompts.get(section) != value:
+            llm_cache.invalidate_section(section)
+            pregenerated_store.invalidate_section(section)
+            changed = True
+    # Готовые досье созданы со старыми промптами
+    if changed:
+        dossier_store.invalidate_generated()
+
+
+def generation_key():
+    # Поколение текстов LLM: модель и шаблоны всех промптов; досье другого поколения не переиспользуются
+    prompts = load_prompts()
+    templates = {section: value['template'] for section, value in prompts.items()}
+    return template_hash(json.dumps({"model": ollama.model, "prompts": templates}, sort_keys=True, ensure_ascii=False))
+
+def pregenerated_key(template):
+    # Предгенерированный текст действителен только для того шаблона, модели и параметров генерации, с которыми создан
+    return template_hash(json.dumps(
+        {"model": ollama.model, "options": ollama.options, "template": template}, sort_keys=True, ensure_ascii=False
+    ))
 
 def reset_prompts():
     with open(PROMPTS_DEFAULT_PATH, 'r', encoding='utf-8') as f:
@@ -638,284 +104,290 @@ def reset_prompts():
 
 # --- parse_and_cache_pdf ---
 def parse_and_cache_pdf(input_path):
-    text = extract_text_from_pdf(input_path)
-    text = clean_text(text)
-    user_name = parse_user_info(text)
-    tasks = {}
-    for i in range(1, 9):
-        task_text = extract_task(text, i)
-        tasks[f"Задание №{i}"] = task_text.strip()
-    return {
-        'user_name': user_name,
-        'tasks': tasks,
-        'task1_parsed': parse_task1(tasks.get("Задание №1", "")),
-        'task2_parsed': parse_task2(tasks.get("Задание №2", "")),
-        'task3_parsed': parse_task3(tasks.get("Задание №3", "")),
-        'task4_parsed': parse_task4(tasks.get("Задание №4", "")),
-        'task5_parsed': parse_task5(tasks.get("Задание №5", "")),
-        'task6_parsed': parse_task6(tasks.get("Задание №6", "")),
-        'task7_parsed': parse_task7(tasks.get("Задание №7", "")),
-        'task8_parsed': parse_task8(tasks.get("Задание №8", "")),
-        'raw_text': text,
-        'input_path': input_path
-    }
+    # Полное извлечение только для страниц с заданиями; страницы разбираются по мере извлечения
+    # input_path — путь к файлу или байты PDF, скачанного в память
+    page_numbers = select_task_pages(input_path)
+    pdf_data = parse_pages(iter_pdf_pages(input_path, page_numbers=page_numbers))
+    if isinstance(input_path, str):
+        pdf_data['input_path'] = input_path
+    return pdf_data
+
+
+async def aparse_and_cache_pdf(input_path):
+    """
+    Разбор PDF в пуле процессов. Длинная выгрузка делится на диапазоны страниц,
+    которые извлекаются параллельно и склеиваются в исходном порядке.
+    """
+    # PDFium не потокобезопасен: все вызовы pypdfium2 (и подсчёт страниц) — только в однопоточных процессах пула
+    page_count = await run_cpu(count_pages, input_path)
+    if not PARALLEL_EXTRACT_MIN_PAGES or page_count < PARALLEL_EXTRACT_MIN_PAGES or min(CPU_POOL_SIZE, page_count) < 2:
+        return await run_cpu(parse_and_cache_pdf, input_path)
+    page_numbers = await run_cpu(select_task_pages, input_path) or list(range(page_count))
+    workers = min(CPU_POOL_SIZE, len(page_numbers))
+    step = -(-len(page_numbers) // workers)
+    chunks = await asyncio.gather(*(
+        run_cpu(extract_pages, input_path, page_numbers[start:start + step])
+        for start in range(0, len(page_numbers), step)
+    ))
+    pdf_data = await run_cpu(parse_pages, [page_text for chunk in chunks for page_text in chunk])
+    if isinstance(input_path, str):
+        pdf_data['input_path'] = input_path
+    return pdf_data
 
 
 # --- АГРЕГАЦИЯ ТЕКСТОВ ДЛЯ РАЗДЕЛОВ ---
+def get_sorted_activity_types(pdf_data):
+    # Типы деятельности по убыванию баллов: [(type_name, score), ...]
+    return activity_scorer.sorted_types(pdf_data)
+
+# Разделы собираются из заранее подготовленных фрагментов (см. fragments.py):
+# *_fragments возвращают список фрагментов, *_text — разметку для промптов
+def build_prof_fragments_for_types(type_names):
+    return [prof_fragment(type_name) for type_name in type_names]
+
+def build_prof_text_for_types(type_names):
+    return join_raw(build_prof_fragments_for_types(type_names))
+
+def build_aggregated_prof_fragments(pdf_data):
+    return build_prof_fragments_for_types([type_name for type_name, score in get_sorted_activity_types(pdf_data)])
+
 def build_aggregated_prof_text(pdf_data):
-    # Аналогично агрегации профиля в process_pdf
-    task1_parsed = pdf_data['task1_parsed']
-    task3_parsed = pdf_data['task3_parsed']
-
-    mappings = [
-        ({"task1": "работе с людьми", "task3": "социальный"}, "Социальный"),
-        ({"task1": "эстетическ", "task3": "артистичный"}, "Артистический"),
-        ({"task1": "работы с информацией", "task3": "консервативный"}, "Информационный"),
-        ({"task1": "практической", "task3": "практический"}, "Практический"),
-        ({"task1": "экстремальн"}, "Экстремальный"),
-        ({"task1": "исследовательской", "task3": "интеллектуальный"}, "Интеллектуальный"),
-        ({"task3": "инициативный"}, "Инициативный")
-    ]
-    def match(description, substr):
-        return substr.lower() in description.lower()
-    scores = {}
-    for rule, type_name in mappings:
-        total = 0
-        if "task1" in rule and "task3" in rule:
-            for t1 in task1_parsed:
-                if match(t1["описание"], rule["task1"]):
-                    for t3 in task3_parsed:
-                        if match(t3["описание"], rule["task3"]):
-                            total += t1["баллы"] + t3["баллы"]
-        elif "task1" in rule:
-            for t1 in task1_parsed:
-                if match(t1["описание"], rule["task1"]):
-                    total += t1["баллы"]
-        elif "task3" in rule:
-            for t3 in task3_parsed:
-                if match(t3["описание"], rule["task3"]):
-                    total += t3["баллы"]
-        if total > 0:
-            scores[type_name] = scores.get(type_name, 0) + total
-    sorted_types = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    aggregated_text_prof = ""
-    for type_name, score in sorted_types:
-        aggregated_text_prof += f"<br/>👉 <b>{type_name} тип деятельности:</b><br/>"
-        if type_name in types_info:
-            info = types_info[type_name]
-            aggregated_text_prof += f"📝 {info['description']}<br/>"
-            aggregated_text_prof += "💼 Подходящие профессии:<br/>"
-            for prof in info["professions"]:
-                aggregated_text_prof += f"   ✔️ {prof}<br/>"
-    return aggregated_text_prof
+    return join_raw(build_aggregated_prof_fragments(pdf_data))
+
+def build_aggregated_talents_fragments(pdf_data):
+    return [talent_fragment(talent) for talent in pdf_data['task8_parsed']]
 
 def build_aggregated_talents_text(pdf_data):
-    task8_parsed = pdf_data['task8_parsed']
-    aggregated_text_talents = ""
-    for talent in task8_parsed:
-        info = hidden_talents_info.get(talent)
-        if info:
-            aggregated_text_talents += f"<br/>✨ {talent}:<br/>"
-            aggregated_text_talents += f"📝 {info['description']}<br/><br/>"
-            aggregated_text_talents += "💡 Примеры реализации:<br/>"
-            aggregated_text_talents += f"{info['examples']}<br/>"
-        else:
-            aggregated_text_talents += f"<br/><br/>❗ Информация по таланту «{talent}» не найдена.<br/><br/>"
-    return aggregated_text_talents
+    return join_raw(build_aggregated_talents_fragments(pdf_data))
 
-def build_aggregated_personality_text(pdf_data):
+def extract_personality(code_str):
+    # Код личности — содержимое в скобках
+    start = code_str.find("(")
+    end = code_str.find(")")
+    if start != -1 and end != -1:
+        return code_str[start+1:end].strip()
+    return None
+
+def build_aggregated_personality_fragments(pdf_data):
     task2_parsed = pdf_data['task2_parsed']
-    def extract_personality(code_str):
-        start = code_str.find("(")
-        end = code_str.find(")")
-        if start != -1 and end != -1:
-            return code_str[start+1:end].strip()
-        return None
     personality_code = extract_personality(task2_parsed)
-    aggregated_text_personality = ""
-    if personality_code and personality_code in personality_info:
-        info = personality_info[personality_code]
-        aggregated_text_personality += f"<br/><br/>🎭 Тип личности: {info['name']}<br/>"
-        aggregated_text_personality += f"📝 {info['description']}<br/><br/>"
-        aggregated_text_personality += "🚀 Давай разберём, что делает тебя таким особенным:<br/><br/>"
-        for feature in info["features"]:
-            aggregated_text_personality += f"🔑 {feature['feature']}:<br/>"
-            aggregated_text_personality += f"📝 {feature['description']}<br/>"
-            aggregated_text_personality += f"💡 {feature['examples']}<br/><br/>"
-    else:
-        aggregated_text_personality = task2_parsed
-    return aggregated_text_personality
+    fragment = personality_fragment(personality_code) if personality_code else None
+    return [fragment or make_fragment(task2_parsed)]
+
+def build_aggregated_personality_text(pdf_data):
+    return join_raw(build_aggregated_personality_fragments(pdf_data))
+
+def build_aggregated_orientations_fragments(pdf_data):
+    return [ORIENTATIONS_INTRO] + [orientation_fragment(result['описание']) for result in pdf_data['task4_parsed']]
 
 def build_aggregated_orientations_text(pdf_data):
-    task4_parsed = pdf_data['task4_parsed']
-    def build_orientations_text(task_results, orientations):
-        aggregated_text_orientations = "Твои ценностные ориентиры помогают тебе понять, что действительно важно для тебя в жизни и карьере. Реализуя их, ты можешь чувствовать себя максимально успешным и гармоничным в своей профессии. <br/> Давай разберём, что значит каждая из них и как они могут реализоваться:"
-        for result in task_results:
-            desc = result['описание']
-            data = orientations.get(desc)
-            if data:
-                aggregated_text_orientations += (
-                    f"<br/>💡{data['ориентир']}<br/>"
-                    f"📝{data['описание']}<br/>"
-                    "✔️ Какой путь тебе подойдет?<br/>"
-                    f"{data['путь']}<br/>"
-                )
-            else:
-                aggregated_text_orientations += f"<br/><br/>❗ Нет данных для описания: {desc}<br/>"
-        return aggregated_text_orientations
-    return build_orientations_text(task4_parsed, orientations)
+    return join_raw(build_aggregated_orientations_fragments(pdf_data))
+
+
+# --- ГЕНЕРАЦИЯ РАЗДЕЛОВ ЧЕРЕЗ LLM ---
+_llm_semaphore = None
+_llm_semaphore_loop = None
+# Число досье, которые сейчас генерируются (для фоновой предгенерации в простое)
+_active_generations = 0
+
+def is_llm_idle():
+    return _active_generations == 0
+
+def _get_llm_semaphore():
+    # Семафор общий для всех досье в процессе, но привязан к текущему event loop
+    global _llm_semaphore, _llm_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _llm_semaphore is None or _llm_semaphore_loop is not loop:
+        _llm_semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+        _llm_semaphore_loop = loop
+    return _llm_semaphore
+
+async def _renew_llm_slot(slot_id):
+    while True:
+        await asyncio.sleep(llm_slots.lease_seconds / 3)
+        if not await run_io(llm_slots.renew, slot_id):
+            logger.warning(f"Место {slot_id} для запроса к Ollama истекло раньше, чем закончилась генерация")
+
+@contextlib.asynccontextmanager
+async def llm_slot():
+    """Место для запроса к Ollama: не больше OLLAMA_NUM_PARALLEL запросов во всех процессах вместе."""
+    # Семафор процесса не даёт его запросам опрашивать общую таблицу сверх лимита
+    async with _get_llm_semaphore():
+        holder = f"{socket.gethostname()}:{os.getpid()}"
+        slot_id = await run_io(llm_slots.acquire, holder, OLLAMA_NUM_PARALLEL)
+        while slot_id is None:
+            await asyncio.sleep(LLM_SLOT_POLL)
+            slot_id = await run_io(llm_slots.acquire, holder, OLLAMA_NUM_PARALLEL)
+        renewer = asyncio.create_task(_renew_llm_slot(slot_id))
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            # Место освобождается и при отмене задачи, иначе оно было бы занято до истечения lease
+            await asyncio.shield(run_io(llm_slots.release, slot_id))
+
+async def invoke_llm(section, prompt, on_chunk=None):
+    # Одинаковые промпты встречаются часто: при попадании в кэш GPU не задействуется
+    key = llm_cache.make_key(ollama.model, ollama.options, prompt)
+    cached = await run_io(llm_cache.get, key)
+    if cached is not None:
+        logger.info(f"Кэш LLM: попадание для секции '{section}'")
+        return cached
+    async with llm_slot():
+        # Ответ читается потоком: при отмене задачи соединение закрывается, и Ollama сразу прекращает генерацию
+        chunks = []
+        async for chunk in ollama.stream(prompt):
+            chunks.append(chunk)
+            if on_chunk is not None:
+                on_chunk(section, chunk)
+        response = "".join(chunks)
+    await run_io(llm_cache.put, key, section, ollama.model, response)
+    return response
+
+async def lookup_pregenerated(section, items, template, user_name):
+    # Учитываем комбинацию для предгенерации и пробуем взять готовый текст
+    if not items:
+        return None
+    combo_key = pregenerated_store.make_combo_key(items)
+    await run_io(pregenerated_store.record, section, combo_key)
+    text = await run_io(pregenerated_store.get, section, combo_key, pregenerated_key(template))
+    if text is None:
+        return None
+    logger.info(f"Предгенерация: готовый текст для секции '{section}'")
+    return text.replace(NAME_PLACEHOLDER, user_name)
+
+async def agenerate_all_resumes(pdf_data, custom_prof_resume=None, custom_talents_resume=None, custom_final_resume=None, on_section=None, on_chunk=None):
+    """
+    Генерирует разделы досье. prof_resume и talents_resume не зависят друг от друга
+    и запрашиваются параллельно, final_resume — после них, так как использует оба.
+    on_section(section, text) вызывается по готовности каждого раздела (для сохранения промежуточных результатов),
+    on_chunk(section, chunk) — на каждый фрагмент текста, пришедший от LLM (для показа хода генерации).
+    """
+    global _active_generations
+    _active_generations += 1
+    try:
+        return await _generate_all_resumes(pdf_data, custom_prof_resume, custom_talents_resume, custom_final_resume, on_section, on_chunk)
+    finally:
+        _active_generations -= 1
+
+async def _generate_all_resumes(pdf_data, custom_prof_resume, custom_talents_resume, custom_final_resume, on_section, on_chunk):
+    prompts = load_prompts()
+    user_name = pdf_data['user_name']
+    prof_types = [type_name for type_name, score in get_sorted_activity_types(pdf_data)]
+    aggregated_text_prof = build_prof_text_for_types(prof_types)
+    aggregated_text_talents = build_aggregated_talents_text(pdf_data)
+
+    async def generate_prof():
+        if custom_prof_resume is not None:
+            return custom_prof_resume
+        template = prompts['prof_resume']['template']
+        pregenerated = await lookup_pregenerated('prof_resume', prof_types, template, user_name)
+        if pregenerated is not None:
+            return pregenerated
+        prompt_prof = template.format(
+            user_name=user_name,
+            aggregated_text_prof=aggregated_text_prof
+        )
+        return await invoke_llm('prof_resume', prompt_prof, on_chunk)
+
+    async def generate_talents():
+        if custom_talents_resume is not None:
+            return custom_talents_resume
+        template = prompts['talents_resume']['template']
+        pregenerated = await lookup_pregenerated('talents_resume', pdf_data['task8_parsed'], template, user_name)
+        if pregenerated is not None:
+            return pregenerated
+        prompt_talents = template.format(
+            user_name=user_name,
+            aggregated_text_talents=aggregated_text_talents
+        )
+        return await invoke_llm('talents_resume', prompt_talents, on_chunk)
+
+    async def section_done(section, generate):
+        text = await generate()
+        if on_section is not None:
+            await on_section(section, text)
+        return text
+
+    async def generate_final():
+        if custom_final_resume is not None:
+            return custom_final_resume
+        prompt_final = prompts['final_resume']['template'].format(
+            user_name=user_name,
+            aggregated_text_prof=aggregated_text_prof,
+            prof_resume=prof_resume,
+            aggregated_text_personality=build_aggregated_personality_text(pdf_data),
+            aggregated_text_orientations=build_aggregated_orientations_text(pdf_data),
+            aggregated_text_talents=aggregated_text_talents,
+            talents_resume=talents_resume
+        )
+        return await invoke_llm('final_resume', prompt_final, on_chunk)
+
+    prof_resume, talents_resume = await asyncio.gather(
+        section_done('prof_resume', generate_prof),
+        section_done('talents_resume', generate_talents)
+    )
+    final_resume = await section_done('final_resume', generate_final)
+    return prof_resume, talents_resume, final_resume
+
+def generate_all_resumes(pdf_data):
+    # Синхронная обёртка для вызова вне event loop
+    return ollama.run_sync(agenerate_all_resumes(pdf_data))
 
 
 # --- create_pdf ---
 def create_pdf(output_path, pdf_data, prof_resume, talents_resume, final_resume):
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Flowable
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import cm
-    from reportlab.lib import colors
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    import os
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    mulish_regular_path = os.path.join(base_dir, 'Mulish-Regular.ttf')
-    mplus_bold_path = os.path.join(base_dir, 'MPLUSRounded1c-ExtraBold.ttf')
-    if not os.path.exists(mulish_regular_path):
-        raise FileNotFoundError(f"Файл шрифта '{mulish_regular_path}' не найден.")
-    if not os.path.exists(mplus_bold_path):
-        raise FileNotFoundError(f"Файл шрифта '{mplus_bold_path}' не найден.")
-    pdfmetrics.registerFont(TTFont('Mulish-Regular', mulish_regular_path))
-    pdfmetrics.registerFont(TTFont('MPlusRounded1cB', mplus_bold_path))
-    styles = getSampleStyleSheet()
-    styles['Normal'].fontName = 'Mulish-Regular'
-    styles['Normal'].fontSize = 14
-    styles['Normal'].leading = 16
-    styles['Heading2'].fontName = "MPlusRounded1cB"
-    styles['Heading2'].fontSize = 16
-    styles['Heading2'].leading = 20
-    title_style = ParagraphStyle(
-        'Title', parent=styles['Heading2'], fontSize=28, alignment=1, spaceAfter=16,
-    )
-    block_header_style = ParagraphStyle(
-        'BlockHeader', parent=styles['Heading2'], fontSize=18, spaceAfter=8,
-    )
-    normal_style = styles['Normal']
-    class RoundedBorderedParagraph(Flowable):
-        def __init__(self, text, style, padding=0.5*cm, radius=10, dash=(3, 3)):
-            Flowable.__init__(self)
-            self.text = text
-            self.style = style
-            self.padding = padding
-            self.radius = radius
-            self.dash = dash
-            self.paragraph = Paragraph(text, style)
-            self.width = 0
-            self.height = 0
-        def wrap(self, availWidth, availHeight):
-            available_text_width = availWidth - 2 * self.padding
-            w, h = self.paragraph.wrap(available_text_width, availHeight - 2 * self.padding)
-            self.width = w + 2 * self.padding
-            self.height = h + 2 * self.padding
-            return self.width, self.height
-        def draw(self):
-            self.canv.saveState()
-            self.canv.setStrokeColor(colors.HexColor('#f8bb42'))
-            self.canv.setLineWidth(1)
-            self.canv.setDash(self.dash[0], self.dash[1])
-            self.canv.roundRect(0, 0, self.width, self.height, self.radius, stroke=1, fill=0)
-            self.canv.restoreState()
-            self.paragraph.drawOn(self.canv, self.padding, self.padding)
-        def split(self, availWidth, availHeight):
-            available_text_width = availWidth - 2 * self.padding
-            available_text_height = availHeight - 2 * self.padding
-            split_paragraphs = self.paragraph.split(available_text_width, available_text_height)
-            if not split_paragraphs:
-                return []
-            flowables = []
-            for p in split_paragraphs:
-                new_flowable = RoundedBorderedParagraph("", self.style, self.padding, self.radius, self.dash)
-                new_flowable.paragraph = p
-                w, h = p.wrap(available_text_width, available_text_height)
-                new_flowable.width = w + 2 * self.padding
-                new_flowable.height = h + 2 * self.padding
-                flowables.append(new_flowable)
-            return flowables
-    class DashedHRFlowable(Flowable):
-        def __init__(self, width, thickness=1):
-            Flowable.__init__(self)
-            self.width = width
-            self.thickness = thickness
-        def wrap(self, availWidth, availHeight):
-            return self.width, self.thickness
-        def draw(self):
-            self.canv.saveState()
-            self.canv.setStrokeColor(colors.HexColor('#f8bb42'))
-            self.canv.setLineWidth(self.thickness)
-            self.canv.setDash(3, 3)
-            self.canv.line(0, self.thickness/2.0, self.width, self.thickness/2.0)
-            self.canv.restoreState()
-    def add_block(title, text_content, story):
-        story.append(Paragraph(title, block_header_style))
-        story.append(Spacer(1, 14))
-        bordered_paragraph = RoundedBorderedParagraph(text_content, normal_style)
-        story.append(bordered_paragraph)
-        story.append(Spacer(1, 24))
-    def header(canvas, doc):
-        width, height = A4
-        header_height = 3 * cm
-        canvas.saveState()
-        canvas.setFillColor(colors.HexColor('#f8bb42'))
-        canvas.rect(0, height - header_height, width, header_height, stroke=0, fill=1)
-        logo_path = os.path.join(base_dir, "logo.png")
-        logo_width = 2.5 * cm
-        logo_height = 2.5 * cm
-        logo_x = 1 * cm
-        logo_y = height - header_height + (header_height - logo_height) / 2.0
-        try:
-            canvas.drawImage(logo_path, logo_x, logo_y, width=logo_width, height=logo_height, preserveAspectRatio=True, mask='auto')
-        except Exception:
-            pass
-        text_lines = ["Помогаем реализовывать", "твои таланты"]
-        text_font = "MPlusRounded1cB"
-        text_size = 20
-        text_color = colors.black
-        text_x = logo_x + logo_width + 0.5 * cm
-        total_text_height = 2 * text_size + 2
-        text_y = height - header_height + (header_height + total_text_height) / 2.0 - text_size
-        try:
-            canvas.setFont(text_font, text_size)
-        except Exception:
-            canvas.setFont("Helvetica-Bold", text_size)
-        canvas.setFillColor(text_color)
-        for line in text_lines:
-            canvas.drawString(text_x, text_y, line)
-            text_y -= text_size + 2
-        canvas.restoreState()
-    emoji_font_size = normal_style.fontSize
-    def safe(text):
-        return text if text else ""
-    # Преобразуем текстовые переменные заранее (ускоряет работу при редактировании)
+    emoji_font_size = EMOJI_FONT_SIZE
+    # Справочные разделы собираются из готовых фрагментов, эмодзи конвертируются только в ответах LLM
     resume = replace_with_emoji_pdf(final_resume, emoji_font_size)
-    aggregated_text_prof = replace_with_emoji_pdf(build_aggregated_prof_text(pdf_data), emoji_font_size)
+    aggregated_text_prof = join_pdf(build_aggregated_prof_fragments(pdf_data))
     prof_resume = replace_with_emoji_pdf(prof_resume, emoji_font_size)
-    aggregated_text_personality = replace_with_emoji_pdf(build_aggregated_personality_text(pdf_data), emoji_font_size)
-    aggregated_text_orientations = replace_with_emoji_pdf(build_aggregated_orientations_text(pdf_data), emoji_font_size)
-    aggregated_text_talents = replace_with_emoji_pdf(build_aggregated_talents_text(pdf_data), emoji_font_size)
+    aggregated_text_personality = join_pdf(build_aggregated_personality_fragments(pdf_data))
+    aggregated_text_orientations = join_pdf(build_aggregated_orientations_fragments(pdf_data))
+    aggregated_text_talents = join_pdf(build_aggregated_talents_fragments(pdf_data))
     talents_resume = replace_with_emoji_pdf(talents_resume, emoji_font_size)
-    story = []
-    story.append(Paragraph("ПРОФДИЗАЙН", title_style))
-    story.append(DashedHRFlowable(A4[0] - 80, thickness=1))
-    story.append(Spacer(1, 24))
-    # Финальный вывод в начале, как в эталоне
-    story.append(Paragraph(resume, normal_style))
-    story.append(Spacer(1, 24))
-    add_block("Профессиональные склонности", aggregated_text_prof + "<br/><br/>" + prof_resume, story)
-    add_block("Личностные особенности", aggregated_text_personality, story)
-    add_block("Ценностные ориентиры", aggregated_text_orientations, story)
-    add_block("Скрытые таланты", aggregated_text_talents + "<br/><br/>" + talents_resume, story)
-    doc = SimpleDocTemplate(output_path, pagesize=A4, rightMargin=40, leftMargin=40, topMargin=3*cm + 40, bottomMargin=40)
-    doc.build(story, onFirstPage=header, onLaterPages=header)
+    render_dossier(
+        output_path,
+        resume,
+        aggregated_text_prof + "<br/><br/>" + prof_resume,
+        aggregated_text_personality,
+        aggregated_text_orientations,
+        aggregated_text_talents + "<br/><br/>" + talents_resume
+    )
     return output_path
 
+
+def render_pdf_bytes(pdf_data, prof_resume, talents_resume, final_resume):
+    # Досье рендерится в память и отправляется из буфера, без записи на диск
+    buffer = io.BytesIO()
+    create_pdf(buffer, pdf_data, prof_resume, talents_resume, final_resume)
+    return buffer.getvalue()
+
+# Код, от которого зависит вид досье: при его изменении ключи досье меняются
+RENDER_SOURCES = ("renderer.py", "fragments.py", "reference_data.py", "activity_scoring.py")
+
+
+def _render_sources_hash():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parts = []
+    for name in RENDER_SOURCES:
+        with open(os.path.join(base_dir, name), 'r', encoding='utf-8') as f:
+            parts.append(f.read())
+    return template_hash("\n".join(parts))
+
+
+RENDER_VERSION = _render_sources_hash()
+
+
+def dossier_key(pdf_data, prof_resume, talents_resume, final_resume):
+    # Досье полностью определяется входами create_pdf и версией кода рендеринга
+    fields = {key: value for key, value in pdf_data.items() if key == 'user_name' or key.endswith('_parsed')}
+    raw = json.dumps(
+        {"render": RENDER_VERSION, "pdf_data": fields, "resumes": [prof_resume, talents_resume, final_resume]},
+        sort_keys=True, ensure_ascii=False
+    )
+    return template_hash(raw)
+
 def get_pdf_output_path(user_name):
     downloads_dir = Path(os.getcwd()) / "downloads"
     # Заменяем только / и \, пробелы оставляем
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+import logging
+import yaml
+from pdf_processor import ollama, pregenerated_key, load_prompts, build_prof_text_for_types, build_aggregated_talents_text, invoke_llm, is_llm_idle
+from llm_cache import pregenerated_store, NAME_PLACEHOLDER
+from executor import run_io
+from job_queue import job_queue
+
+logger = logging.getLogger(__name__)
+
+PREGENERATE_SECTIONS = ('prof_resume', 'talents_resume')
+# Сколько текстов генерируется за один проход
+PREGENERATE_LIMIT = int(os.getenv("PREGENERATE_LIMIT", "20"))
+# Интервал фоновой предгенерации в боте, секунды (0 — выключено)
+PREGENERATE_INTERVAL = int(os.getenv("PREGENERATE_INTERVAL", "0"))
+# Дополнительный список комбинаций, которые нужно подготовить заранее
+PREGENERATE_COMBINATIONS_FILE = os.getenv("PREGENERATE_COMBINATIONS_FILE", "pregenerate.yaml")
+
+
+async def gpu_idle():
+    # Предгенерация — низший класс приоритета: уступает досье этого процесса и любым задачам в общей очереди
+    return is_llm_idle() and not await run_io(job_queue.pending)
+
+
+def load_configured_combinations():
+    if not os.path.exists(PREGENERATE_COMBINATIONS_FILE):
+        return {}
+    with open(PREGENERATE_COMBINATIONS_FILE, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    return {
+        section: [pregenerated_store.make_combo_key(items) for items in (data.get(section) or []) if items]
+        for section in PREGENERATE_SECTIONS
+    }
+
+
+def render_prompt(section, template, items):
+    if section == 'prof_resume':
+        return template.format(
+            user_name=NAME_PLACEHOLDER,
+            aggregated_text_prof=build_prof_text_for_types(items)
+        )
+    return template.format(
+        user_name=NAME_PLACEHOLDER,
+        aggregated_text_talents=build_aggregated_talents_text({'task8_parsed': items})
+    )
+
+
+async def pregenerate_pending(limit=PREGENERATE_LIMIT, only_when_idle=False):
+    """
+    Генерирует тексты для настроенных и самых частых комбинаций, которых ещё нет
+    под текущие шаблоны промптов. Возвращает число сгенерированных текстов.
+    """
+    prompts = load_prompts()
+    configured = load_configured_combinations()
+    done = 0
+    for section in PREGENERATE_SECTIONS:
+        template = prompts[section]['template']
+        tmpl_hash = pregenerated_key(template)
+        candidates = []
+        for combo_key in configured.get(section, []):
+            if await run_io(pregenerated_store.get, section, combo_key, tmpl_hash) is None:
+                candidates.append(combo_key)
+        candidates += await run_io(pregenerated_store.missing_combinations, section, tmpl_hash, limit)
+        for combo_key in dict.fromkeys(candidates):
+            if done >= limit:
+                return done
+            # Уступаем GPU, как только появилось реальное досье
+            if only_when_idle and not await gpu_idle():
+                return done
+            items = json.loads(combo_key)
+            text = await invoke_llm(section, render_prompt(section, template, items))
+            await run_io(pregenerated_store.put, section, combo_key, tmpl_hash, text)
+            done += 1
+    return done
+
+
+async def pregenerate_loop():
+    while True:
+        await asyncio.sleep(PREGENERATE_INTERVAL)
+        if not await gpu_idle():
+            continue
+        try:
+            done = await pregenerate_pending(only_when_idle=True)
+            if done:
+                logger.info(f"Предгенерация: подготовлено текстов {done}")
+        except Exception:
+            logger.exception("Ошибка фоновой предгенерации")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    done = ollama.run_sync(pregenerate_pending())
+    logger.info(f"Предгенерация завершена: подготовлено текстов {done}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limit(value):
+    """'N/S' — не больше N действий за S секунд (с накоплением до N); пусто или 0 — без ограничения."""
+    if not value or value.strip() == "0":
+        return None
+    count, _, seconds = value.partition("/")
+    return int(count), float(seconds or 3600)
+
+
+# Лимиты дорогих действий: загрузки выгрузок (полная генерация через LLM) и пересоздание досье после правки.
+# Отдельно для пользователя и для чата (в групповом чате лимит общий на всех участников)
+RATE_LIMITS = {
+    'upload': {
+        'user': parse_limit(os.getenv("RATE_LIMIT_USER_UPLOADS", "5/600")),
+        'chat': parse_limit(os.getenv("RATE_LIMIT_CHAT_UPLOADS", "20/600")),
+    },
+    'edit': {
+        'user': parse_limit(os.getenv("RATE_LIMIT_USER_EDITS", "20/600")),
+        'chat': parse_limit(os.getenv("RATE_LIMIT_CHAT_EDITS", "40/600")),
+    },
+}
+# При стольких корзинах в памяти полные (давно не использованные) удаляются
+RATE_LIMIT_MAX_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, capacity, period, now):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        # Время создания — то же, что у вызывающего: иначе первый refill уходит в минус и новая корзина неполная
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        # Через сколько секунд накопится целый токен
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    @property
+    def full(self):
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """
+    Ограничитель по алгоритму token bucket в памяти процесса бота.
+    Действие разрешено, только если токен есть и в корзине пользователя, и в корзине чата.
+    """
+
+    def __init__(self, limits=RATE_LIMITS, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets = {}
+
+    def _bucket(self, action, scope, key, now):
+        limit = self.limits.get(action, {}).get(scope)
+        if limit is None:
+            return None
+        bucket = self._buckets.get((action, scope, key))
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune(now)
+            bucket = self._buckets[(action, scope, key)] = TokenBucket(*limit, now)
+        bucket.refill(now)
+        return bucket
+
+    def _prune(self, now):
+        for bucket_key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.full:
+                del self._buckets[bucket_key]
+
+    def acquire(self, action, user_id, chat_id):
+        """Списывает токен действия; возвращает 0, если действие разрешено, иначе сколько секунд подождать."""
+        now = time.monotonic()
+        buckets = [
+            bucket for bucket in (
+                self._bucket(action, 'user', user_id, now),
+                self._bucket(action, 'chat', chat_id, now),
+            )
+            if bucket is not None
+        ]
+        wait = max((bucket.wait_time() for bucket in buckets), default=0.0)
+        if wait > 0:
+            logger.info(f"Лимит '{action}': пользователь {user_id} в чате {chat_id}, повтор через {wait:.0f} с")
+            return wait
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return 0.0
+
+    def refund(self, action, user_id, chat_id):
+        """Возвращает токен действия, которое всё-таки не выполнено (например, очередь переполнена)."""
+        now = time.monotonic()
+        for scope, key in (('user', user_id), ('chat', chat_id)):
+            bucket = self._bucket(action, scope, key, now)
+            if bucket is not None:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+
+rate_limiter = RateLimiter()
@@ -109,6 +109,18 @@ types_info = {
         }
     }
 
+# Правила подсчёта баллов типов деятельности: подстроки (без учёта регистра) в описаниях
+# пунктов задания 1 и задания 3. Если заданы обе подстроки, баллы складываются по всем парам совпадений.
+activity_type_rules = [
+    {"type": "Социальный", "task1": "работе с людьми", "task3": "социальный"},
+    {"type": "Артистический", "task1": "эстетическ", "task3": "артистичный"},
+    {"type": "Информационный", "task1": "работы с информацией", "task3": "консервативный"},
+    {"type": "Практический", "task1": "практической", "task3": "практический"},
+    {"type": "Экстремальный", "task1": "экстремальн"},
+    {"type": "Интеллектуальный", "task1": "исследовательской", "task3": "интеллектуальный"},
+    {"type": "Инициативный", "task3": "инициативный"},
+]
+
 # Скрытые таланты
 hidden_talents_info = {
         "Катализатор": {
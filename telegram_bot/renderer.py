@@ -0,0 +1,176 @@
+import io
+import os
+import logging
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Flowable
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.lib import colors
+
+logger = logging.getLogger(__name__)
+
+# Шрифты, стили и flowable-классы создаются один раз на процесс при импорте модуля,
+# а не на каждый вызов create_pdf
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MULISH_REGULAR_PATH = os.path.join(BASE_DIR, 'Mulish-Regular.ttf')
+MPLUS_BOLD_PATH = os.path.join(BASE_DIR, 'MPLUSRounded1c-ExtraBold.ttf')
+LOGO_PATH = os.path.join(BASE_DIR, "logo.png")
+ACCENT_COLOR = colors.HexColor('#f8bb42')
+
+if not os.path.exists(MULISH_REGULAR_PATH):
+    raise FileNotFoundError(f"Файл шрифта '{MULISH_REGULAR_PATH}' не найден.")
+if not os.path.exists(MPLUS_BOLD_PATH):
+    raise FileNotFoundError(f"Файл шрифта '{MPLUS_BOLD_PATH}' не найден.")
+pdfmetrics.registerFont(TTFont('Mulish-Regular', MULISH_REGULAR_PATH))
+pdfmetrics.registerFont(TTFont('MPlusRounded1cB', MPLUS_BOLD_PATH))
+
+# Логотип читается один раз; если файла нет, колонтитул рисуется без него
+try:
+    LOGO = ImageReader(LOGO_PATH)
+except Exception:
+    LOGO = None
+
+styles = getSampleStyleSheet()
+styles['Normal'].fontName = 'Mulish-Regular'
+styles['Normal'].fontSize = 14
+styles['Normal'].leading = 16
+styles['Heading2'].fontName = "MPlusRounded1cB"
+styles['Heading2'].fontSize = 16
+styles['Heading2'].leading = 20
+title_style = ParagraphStyle(
+    'Title', parent=styles['Heading2'], fontSize=28, alignment=1, spaceAfter=16,
+)
+block_header_style = ParagraphStyle(
+    'BlockHeader', parent=styles['Heading2'], fontSize=18, spaceAfter=8,
+)
+normal_style = styles['Normal']
+# Размер эмодзи совпадает с размером основного текста
+EMOJI_FONT_SIZE = normal_style.fontSize
+
+
+class RoundedBorderedParagraph(Flowable):
+    # Текст в пунктирной рамке с закруглёнными углами
+    def __init__(self, text, style, padding=0.5*cm, radius=10, dash=(3, 3)):
+        Flowable.__init__(self)
+        self.text = text
+        self.style = style
+        self.padding = padding
+        self.radius = radius
+        self.dash = dash
+        self.paragraph = Paragraph(text, style)
+        self.width = 0
+        self.height = 0
+
+    def wrap(self, availWidth, availHeight):
+        available_text_width = availWidth - 2 * self.padding
+        w, h = self.paragraph.wrap(available_text_width, availHeight - 2 * self.padding)
+        self.width = w + 2 * self.padding
+        self.height = h + 2 * self.padding
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.saveState()
+        self.canv.setStrokeColor(ACCENT_COLOR)
+        self.canv.setLineWidth(1)
+        self.canv.setDash(self.dash[0], self.dash[1])
+        self.canv.roundRect(0, 0, self.width, self.height, self.radius, stroke=1, fill=0)
+        self.canv.restoreState()
+        self.paragraph.drawOn(self.canv, self.padding, self.padding)
+
+    def split(self, availWidth, availHeight):
+        available_text_width = availWidth - 2 * self.padding
+        available_text_height = availHeight - 2 * self.padding
+        split_paragraphs = self.paragraph.split(available_text_width, available_text_height)
+        if not split_paragraphs:
+            return []
+        flowables = []
+        for p in split_paragraphs:
+            new_flowable = RoundedBorderedParagraph("", self.style, self.padding, self.radius, self.dash)
+            new_flowable.paragraph = p
+            w, h = p.wrap(available_text_width, available_text_height)
+            new_flowable.width = w + 2 * self.padding
+            new_flowable.height = h + 2 * self.padding
+            flowables.append(new_flowable)
+        return flowables
+
+
+class DashedHRFlowable(Flowable):
+    # Пунктирная линия под заголовком
+    def __init__(self, width, thickness=1):
+        Flowable.__init__(self)
+        self.width = width
+        self.thickness = thickness
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.thickness
+
+    def draw(self):
+        self.canv.saveState()
+        self.canv.setStrokeColor(ACCENT_COLOR)
+        self.canv.setLineWidth(self.thickness)
+        self.canv.setDash(3, 3)
+        self.canv.line(0, self.thickness/2.0, self.width, self.thickness/2.0)
+        self.canv.restoreState()
+
+
+def add_block(title, text_content, story):
+    story.append(Paragraph(title, block_header_style))
+    story.append(Spacer(1, 14))
+    story.append(RoundedBorderedParagraph(text_content, normal_style))
+    story.append(Spacer(1, 24))
+
+
+def header(canvas, doc):
+    # Верхний колонтитул на каждой странице
+    width, height = A4
+    header_height = 3 * cm
+    canvas.saveState()
+    canvas.setFillColor(ACCENT_COLOR)
+    canvas.rect(0, height - header_height, width, header_height, stroke=0, fill=1)
+    logo_width = 2.5 * cm
+    logo_height = 2.5 * cm
+    logo_x = 1 * cm
+    logo_y = height - header_height + (header_height - logo_height) / 2.0
+    if LOGO is not None:
+        canvas.drawImage(LOGO, logo_x, logo_y, width=logo_width, height=logo_height, preserveAspectRatio=True, mask='auto')
+    text_lines = ["Помогаем реализовывать", "твои таланты"]
+    text_size = 20
+    text_x = logo_x + logo_width + 0.5 * cm
+    total_text_height = 2 * text_size + 2
+    text_y = height - header_height + (header_height + total_text_height) / 2.0 - text_size
+    canvas.setFont("MPlusRounded1cB", text_size)
+    canvas.setFillColor(colors.black)
+    for line in text_lines:
+        canvas.drawString(text_x, text_y, line)
+        text_y -= text_size + 2
+    canvas.restoreState()
+
+
+def render_dossier(output, resume, prof_text, personality_text, orientations_text, talents_text):
+    """
+    Собирает PDF-досье из готовой разметки разделов (эмодзи уже заменены на <img>).
+    output — путь к файлу или файлоподобный объект.
+    """
+    story = []
+    story.append(Paragraph("ПРОФДИЗАЙН", title_style))
+    story.append(DashedHRFlowable(A4[0] - 80, thickness=1))
+    story.append(Spacer(1, 24))
+    # Финальный вывод в начале, как в эталоне
+    story.append(Paragraph(resume, normal_style))
+    story.append(Spacer(1, 24))
+    add_block("Профессиональные склонности", prof_text, story)
+    add_block("Личностные особенности", personality_text, story)
+    add_block("Ценностные ориентиры", orientations_text, story)
+    add_block("Скрытые таланты", talents_text, story)
+    doc = SimpleDocTemplate(output, pagesize=A4, rightMargin=40, leftMargin=40, topMargin=3*cm + 40, bottomMargin=40)
+    doc.build(story, onFirstPage=header, onLaterPages=header)
+    return output
+
+
+def warm_up():
+    # Пробный рендер в память: прогревает шрифты и кэши ReportLab до первого досье
+    render_dossier(io.BytesIO(), "Тест", "Тест", "Тест", "Тест", "Тест")
+    logger.info("Рендерер прогрет")
@@ -0,0 +1,112 @@
+"""
+Синтетические выгрузки для проверки совместимости движков извлечения текста (python pdf_extract.py samples).
+Повторяют структуру выгрузки: имя, задания №1–8 с заголовками «Тест пройден:», пункты с маркером 💡
+и баллами, колонтитулы со ссылкой на профиль, датой и номером страницы. Данные вымышленные.
+Проверка сравнивает и разбор с предварительным поиском страниц (PDF_INDEX_PASS) с полным извлечением.
+Пересоздать: python samples/make_samples.py
+"""
+import os
+import re
+import pypdfium2 as pdfium
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak
+
+SAMPLES_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_PATH = os.path.join(SAMPLES_DIR, "..", "Mulish-Regular.ttf")
+MARKER = "💡"
+# Строка-маркер: с неё начинается новая страница
+PAGE_BREAK = object()
+
+# Несжатые потоки: ToUnicode-карту шрифта нужно поправить после сборки (см. map_marker)
+rl_config.pageCompression = 0
+
+
+def export_lines(user_name, activity_scores, personality, values, talents, intro=0, answer_lines=1, extra_task=0, cover=()):
+    lines = list(cover) + ([PAGE_BREAK] if cover else [])
+    lines += [user_name] + ["Вводный текст страницы выгрузки"] * intro
+    lines += ["Задание №1. Профессиональные склонности", "Тест пройден:", "2024-09-23 12:03:45",
+              f"1. Профессиональные склонности {MARKER}", "Количество баллов: 0"]
+    for number, (activity, points) in enumerate(activity_scores, 2):
+        lines += [f"{number}. {activity} {MARKER} описание склонности", f"Количество баллов: {points}"]
+    lines += ["Задание №2. Тип", "Тест пройден:", "23.09.2024, 12:58", "Текст задания", "Вторая строка задания"]
+    lines += ["Задание №3. Профессиональный тип личности", "Тест пройден:", "23.09.2024, 12:58",
+              f"1. Профессиональный тип личности {MARKER}", "Количество баллов: 0",
+              f"2. {personality} {MARKER}", "Количество баллов: 7"]
+    lines += ["Задание №4. Ценностные ориентиры", "Тест пройден:", "23.09.2024, 12:58",
+              "1. Ценностные ориентиры Описание", "Количество баллов: 0"]
+    for number, (value, points) in enumerate(values, 2):
+        lines += [f"{number}. {value} Описание ориентира", f"Количество баллов: {points}"]
+    lines += ["Задание №5. Вопрос", "Тест пройден:", "23.09.2024, 12:58", "Вопрос №1", "Ответ"]
+    lines += ["Мой ответ на вопрос, строка ответа"] * answer_lines
+    lines += ["Задание №6. Вопросы", "Тест пройден:", "23.09.2024, 12:58",
+              "Вопрос №1 текст", "Ответ первый", "Вопрос №2 текст", "Ответ второй"]
+    lines += ["Задание №7. Эссе", "Тест пройден:", "23.09.2024, 12:58", "Ответ строка эссе"]
+    lines += ["Продолжение эссе"] * answer_lines
+    lines += ["Задание №8. Таланты", "Тест пройден:", "23.09.2024, 12:58"] + talents
+    if extra_task:
+        lines += ["Задание №9. Дополнительно", "Тест пройден:", "23.09.2024, 12:58"] + ["Хвост выгрузки"] * extra_task
+    return lines
+
+
+def map_marker(data):
+    # В шрифте нет глифа 💡, и ReportLab выводит вместо него глиф 0.
+    # Сопоставляем глифу 0 символ 💡 в ToUnicode, чтобы маркер извлекался из текста, как в настоящей выгрузке
+    return re.sub(rb"<00> <0000>", b"<00> <D83DDCA1>", data)
+
+
+def build(path, lines):
+    pdfmetrics.registerFont(TTFont('Mulish', FONT_PATH))
+    style = ParagraphStyle('sample', fontName='Mulish', fontSize=11, leading=14)
+    story = [PageBreak() if line is PAGE_BREAK else Paragraph(line or " ", style) for line in lines]
+
+    def on_page(canvas, doc):
+        canvas.setFont('Mulish', 9)
+        canvas.drawString(40, 20, f"https://bot.youcan.by/admin/info/user/123/ {doc.page}/9")
+        canvas.drawString(40, A4[1] - 20, "23.09.2024, 12:58 Профдизайн")
+
+    SimpleDocTemplate(path, pagesize=A4, pageCompression=0).build(story, onFirstPage=on_page, onLaterPages=on_page)
+    with open(path, 'rb') as f:
+        data = map_marker(f.read())
+    # Длина потока ToUnicode изменилась: пересохраняем через pypdfium2, чтобы таблица xref была верной
+    pdf = pdfium.PdfDocument(data)
+    pdf.save(path)
+    pdf.close()
+
+
+SAMPLES = {
+    "short.pdf": export_lines(
+        "Иван Петров", [("Социальный", 8), ("Творческий", 7), ("Технический", 6)], "ENFP",
+        [("Свобода", 5), ("Карьера", 8)], ["Лидерство", "Эмпатия Креативность"]
+    ),
+    # Задания переходят со страницы на страницу посреди длинных ответов
+    "multipage.pdf": export_lines(
+        "Анна Смирнова", [("Практический", 9), ("Инициативный", 4), ("Социальный", 4)], "ISTJ",
+        [("Стабильность", 9), ("Развитие", 3), ("Признание", 1)], ["Аналитика", "Ответственность"],
+        answer_lines=60
+    ),
+    # Вводные страницы до первого задания и лишнее задание после восьмого
+    "prepost.pdf": export_lines(
+        "Пётр Иванов", [("Творческий", 10), ("Социальный", 2), ("Практический", 1)], "INFP",
+        [("Творчество", 7)], ["Воображение"], intro=80, extra_task=80
+    ),
+    # Титульный лист без имени: имя на второй странице, до заданий ещё вводные страницы
+    "cover.pdf": export_lines(
+        "Мария Кузнецова", [("Социальный", 6), ("Технический", 5), ("Творческий", 3)], "ESFJ",
+        [("Общение", 6), ("Польза", 4)], ["Организованность"], intro=60, extra_task=80,
+        cover=["Профдизайн", "Отчёт о прохождении тестирования"]
+    ),
+}
+
+
+def main():
+    for name, lines in SAMPLES.items():
+        build(os.path.join(SAMPLES_DIR, name), lines)
+        print(f"{name}: {len(lines)} строк")
+
+
+if __name__ == "__main__":
+    main()
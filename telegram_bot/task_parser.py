@@ -0,0 +1,344 @@
+import os
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Разбор текста результатов тестирования.
+# Все шаблоны компилируются один раз; текст делится на блоки "Задание №N" за один проход,
+# каждый блок разбирается последовательным сканированием без возвратов, поэтому время
+# разбора линейно по длине текста. Для гарантии верхней границы текст ограничен по длине.
+MAX_PARSE_CHARS = int(os.getenv("MAX_PARSE_CHARS", "1000000"))
+TASK_COUNT = 8
+
+# Мусор, который удаляется из текста за один проход (порядок альтернатив важен):
+# ссылки на профиль с номером страницы "18/20" и без, даты "23.09.2024, 12:58"
+# и "2024-09-23 12:03:45", номера страниц "18/20"
+CLEAN_RE = re.compile(
+    r"(?:https?://)?bot\.youcan\.by/admin/info/user/\d+/\s*\d+/\d+"
+    r"|(?:https?://)?bot\.youcan\.by/admin/info/user/\d+/"
+    r"|\d{1,2}\.\d{1,2}\.\d{4},? \d{1,2}:\d{2}"
+    r"|\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}"
+    r"|\d+/\d+"
+)
+NAME_RE = re.compile(r"^[А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)+$")
+TASK_HEADER_RE = re.compile(r"Задание\s*№(\d+)")
+TEST_PASSED = "Тест пройден:"
+ITEM_START_RE = re.compile(r"(\d+)\.\s*")
+POINTS_RE = re.compile(r"Количество баллов:\s*(\d+)")
+ITEM_MARKER = "💡"
+CAPITALIZED_WORD_RE = re.compile(r"\s+[А-ЯЁ]")
+ANSWER = "Ответ"
+ANSWER_END_RE = re.compile(r"Задание\s*№|Вопрос\s*№")
+QUESTION_END_RE = re.compile(r"Вопрос\s*№\d+")
+DATE_TIME_RE = re.compile(r"\d{1,2}\.\d{1,2}\.\d{4},\s*\d{1,2}:\d{2}")
+LINK_RE = re.compile(r"(https?://|www\.)")
+PAGE_COUNTER_RE = re.compile(r"\d+/\d+")
+CYRILLIC_WORD_RE = re.compile(r"[А-ЯЁа-яё]+")
+
+
+def clean_page_text(text):
+    # Очистка без обрезки пробелов по краям: страницы склеиваются так же, как цельный текст
+    return CLEAN_RE.sub("", text)
+
+
+def clean_text(text):
+    return clean_page_text(text).strip()
+
+
+def parse_user_info(text):
+    lines = text.strip().splitlines()
+    for line in lines[:10]:
+        candidate = line.strip()
+        if NAME_RE.match(candidate):
+            return candidate
+    return lines[0].strip() if lines else ""
+
+
+def get_task_body(task_text):
+    """
+    Из блока задания возвращает содержимое после строки, содержащей "Тест пройден:"
+    (то есть пропускает заголовок с датой и временем).
+    """
+    pos = task_text.find(TEST_PASSED)
+    while pos != -1:
+        # После "Тест пройден:" идут пробельные символы с хотя бы одним переводом строки,
+        # затем строка с датой; тело начинается со следующей строки
+        start = pos + len(TEST_PASSED)
+        end = start
+        while end < len(task_text) and task_text[end].isspace():
+            end += 1
+        last_newline = task_text.rfind("\n", start, end)
+        if last_newline != -1:
+            date_end = task_text.find("\n", last_newline + 1)
+            if date_end != -1:
+                return task_text[date_end + 1:].strip()
+            # Строка даты последняя: тело — после последнего перевода строки в пробелах
+            if task_text.rfind("\n", start, last_newline) != -1:
+                return task_text[last_newline + 1:].strip()
+        pos = task_text.find(TEST_PASSED, pos + 1)
+    return task_text.strip()
+
+
+class TaskSplitter:
+    """
+    Инкрементально делит поток текста на блоки заданий по заголовкам "Задание №N".
+    Блок задания N — от первого заголовка "Задание №N." до следующего заголовка любого задания.
+    Закрытый блок разбирается сразу; в памяти остаётся только текст незакрытого блока.
+    """
+
+    # Сколько символов предыдущего текста просматривается вместе с новым куском:
+    # заголовок может быть разрезан границей страницы
+    HEADER_LOOKBACK = 32
+
+    def __init__(self):
+        self.tasks = {}
+        self._parts = []
+        self._header = None
+        self._block_start = -1
+        self._carry = ""
+        self._offset = 0
+
+    def feed(self, chunk):
+        window = self._carry + chunk
+        window_start = self._offset - len(self._carry)
+        self._offset += len(chunk)
+        self._carry = window[-self.HEADER_LOOKBACK:]
+        if self._header is not None:
+            self._parts.append(chunk)
+        text = None
+        block_pos = 0
+        for header in TASK_HEADER_RE.finditer(window):
+            start = window_start + header.start()
+            if start <= self._block_start:
+                continue
+            # Номер у конца полученного текста может быть неполным ("№1" вместо "№12") — ждём следующий кусок
+            if header.end() >= len(window):
+                break
+            if text is None:
+                # Куски склеиваются один раз на кусок с заголовками, а не на каждую страницу
+                if self._header is not None:
+                    text, base = "".join(self._parts), self._block_start
+                else:
+                    text, base = window, window_start
+            position = start - base
+            self._close_block(text[block_pos:position])
+            self._header = header.group(1) if window.startswith(".", header.end()) else None
+            self._block_start = start
+            block_pos = position
+        if text is not None:
+            self._parts = [text[block_pos:]] if self._header is not None else []
+
+    def _close_block(self, block):
+        if self._header is None:
+            return
+        # Номер сравнивается как строка: "№01." не считается заголовком задания 1
+        task_number = int(self._header)
+        if str(task_number) == self._header and task_number not in self.tasks:
+            self.tasks[task_number] = get_task_body(block)
+
+    @property
+    def done(self):
+        return all(n in self.tasks for n in range(1, TASK_COUNT + 1))
+
+    def close(self):
+        block = "".join(self._parts)
+        # Отложенный заголовок в самом конце потока закрывает последний блок
+        window_start = self._offset - len(self._carry)
+        for header in TASK_HEADER_RE.finditer(self._carry):
+            start = window_start + header.start()
+            if start > self._block_start:
+                self._close_block(block[:start - self._block_start])
+                break
+        else:
+            # Хвост потока обрезается, как у очищенного текста
+            self._close_block(block.rstrip())
+        self._parts = []
+        self._header = None
+        return self.tasks
+
+
+def split_tasks(text):
+    """Делит очищенный текст на блоки заданий. Возвращает {N: тело задания}."""
+    splitter = TaskSplitter()
+    splitter.feed(text)
+    return splitter.close()
+
+
+def extract_task(text, task_number):
+    return split_tasks(text).get(task_number, "")
+
+
+def iter_scored_items(task_text):
+    # Пункты вида "N. описание 💡 ... Количество баллов: M"
+    pos = 0
+    while True:
+        start = ITEM_START_RE.search(task_text, pos)
+        if not start:
+            return
+        description_start = start.end()
+        marker = task_text.find(ITEM_MARKER, description_start + 1)
+        points = POINTS_RE.search(task_text, marker + len(ITEM_MARKER)) if marker != -1 else None
+        if points:
+            yield start.group(1), task_text[description_start:marker].rstrip(), points.group(1)
+        elif description_start > start.end(1) + 1 and task_text.startswith(ITEM_MARKER, description_start):
+            # "N. 💡" без описания: описанием считается пробел перед маркером
+            points = POINTS_RE.search(task_text, description_start + len(ITEM_MARKER))
+            if not points:
+                return
+            yield start.group(1), "", points.group(1)
+        else:
+            return
+        pos = points.end()
+
+
+def parse_scored_items(task_text, header):
+    parsed = []
+    for num, description, points in iter_scored_items(task_text):
+        normalized = " ".join(description.split()).lower()
+        if normalized == header:
+            continue
+        parsed.append({
+            "пункт": int(num),
+            # Удаляем переносы строк в значениях словаря
+            "описание": description.strip().replace('\n', ' ').replace('\r', ''),
+            "баллы": int(points)
+        })
+    return parsed
+
+
+def parse_task1(task_text):
+    return parse_scored_items(task_text, "профессиональные склонности")
+
+
+def parse_task2(task_text):
+    # Удаляем переносы строк перед возвратом
+    return task_text.replace('\n', '<br/>').replace('\r', '')
+
+
+def parse_task3(task_text):
+    return parse_scored_items(task_text, "профессиональный тип личности")
+
+
+def parse_task4(task_text):
+    # Пункты вида "N. ориентир Описание... Количество баллов: M": название — до первого слова с заглавной буквы
+    header = "ценностные ориентиры"
+    parsed = []
+    pos = 0
+    while True:
+        start = ITEM_START_RE.search(task_text, pos)
+        if not start:
+            break
+        description_start = start.end()
+        description_end = CAPITALIZED_WORD_RE.search(task_text, description_start + 1)
+        points = POINTS_RE.search(task_text, description_end.start()) if description_end else None
+        if points:
+            description = " ".join(task_text[description_start:description_end.start()].split())
+        elif description_start - start.end(1) > 2 and CAPITALIZED_WORD_RE.match(task_text, description_start - 1):
+            # "N.  Слово" без описания: описанием считается пробел перед словом
+            points = POINTS_RE.search(task_text, description_start - 1)
+            if not points:
+                break
+            description = ""
+        else:
+            break
+        if description.lower() != header:
+            parsed.append({"описание": description, "баллы": int(points.group(1))})
+        pos = points.end()
+    # Сортировка по количеству баллов (от большего к меньшему)
+    return sorted(parsed, key=lambda x: x["баллы"], reverse=True)
+
+
+def find_answer(task_text, pos, end_re):
+    # Текст после "Ответ" до ближайшего терминатора или конца текста: (ответ, позиция терминатора)
+    answer = task_text.find(ANSWER, pos)
+    if answer == -1:
+        return None, -1
+    start = answer + len(ANSWER)
+    end = end_re.search(task_text, start)
+    end_pos = end.start() if end else len(task_text)
+    return task_text[start:end_pos].strip(), end_pos
+
+
+def parse_task5(task_text):
+    result, _ = find_answer(task_text, 0, ANSWER_END_RE)
+    # Удаляем переносы строк перед возвратом
+    return (result or "").replace('\n', ' ').replace('\r', '')
+
+
+def parse_task6(task_text):
+    answers = []
+    pos = 0
+    while True:
+        answer, pos = find_answer(task_text, pos, QUESTION_END_RE)
+        if answer is None:
+            break
+        # Очищаем и возвращаем список ответов
+        answers.append(answer.replace('\n', ' ').replace('\r', ''))
+    return answers
+
+
+def parse_task7(task_text):
+    result, _ = find_answer(task_text, 0, ANSWER_END_RE)
+    # Удаляем переносы строк перед возвратом
+    return (result or "").replace('\n', '<br/>').replace('\r', '<br/>')
+
+
+def parse_task8(task_text):
+    date_match = DATE_TIME_RE.search(task_text)
+    remaining_text = task_text[date_match.end():] if date_match else task_text
+    filtered_lines = []
+    for line in remaining_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if LINK_RE.search(line) or PAGE_COUNTER_RE.search(line):
+            continue
+        words = line.split()
+        if 1 <= len(words) <= 2 and all(CYRILLIC_WORD_RE.fullmatch(word) for word in words):
+            filtered_lines.append(line)
+    return filtered_lines
+
+
+def parse_pages(pages):
+    """
+    Разбирает выгрузку, поступающую постранично (уже очищенные страницы):
+    блоки заданий выделяются по мере поступления страниц. Как только закрыт блок
+    последнего нужного задания, остальные страницы не запрашиваются.
+    """
+    splitter = TaskSplitter()
+    chunks = []
+    total = 0
+    for page_text in pages:
+        if total + len(page_text) > MAX_PARSE_CHARS:
+            logger.warning(f"Текст выгрузки обрезан до {MAX_PARSE_CHARS} символов")
+            page_text = page_text[:MAX_PARSE_CHARS - total]
+            chunks.append(page_text)
+            splitter.feed(page_text)
+            break
+        total += len(page_text)
+        chunks.append(page_text)
+        splitter.feed(page_text)
+        if splitter.done:
+            break
+    text = "".join(chunks).strip()
+    blocks = splitter.close()
+    tasks = {f"Задание №{i}": blocks.get(i, "").strip() for i in range(1, TASK_COUNT + 1)}
+    return {
+        'user_name': parse_user_info(text),
+        'tasks': tasks,
+        'task1_parsed': parse_task1(tasks["Задание №1"]),
+        'task2_parsed': parse_task2(tasks["Задание №2"]),
+        'task3_parsed': parse_task3(tasks["Задание №3"]),
+        'task4_parsed': parse_task4(tasks["Задание №4"]),
+        'task5_parsed': parse_task5(tasks["Задание №5"]),
+        'task6_parsed': parse_task6(tasks["Задание №6"]),
+        'task7_parsed': parse_task7(tasks["Задание №7"]),
+        'task8_parsed': parse_task8(tasks["Задание №8"]),
+        'raw_text': text,
+    }
+
+
+def parse_text(text):
+    """Разбирает очищенный текст выгрузки: имя, блоки заданий и результаты по каждому заданию."""
+    return parse_pages([text])
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+import time
+from telegram import Chat, Message, Update
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=None, chat=chat))
+
+
+async def run_updates(processor, updates):
+    """Обрабатывает апдейты (update, длительность) как Application; возвращает время завершения и порядок."""
+    start = time.monotonic()
+    finished = {}
+    order = []
+
+    async def handler(update, delay):
+        order.append(update.update_id)
+        await asyncio.sleep(delay)
+        finished[update.update_id] = time.monotonic() - start
+
+    await asyncio.gather(*(processor.process_update(update, handler(update, delay)) for update, delay in updates))
+    return finished, order
+
+
+def test_busy_chat_does_not_delay_other_chats():
+    # Очередь занятого чата не должна занимать глобальные места, которые нужны другому чату
+    processor = ChatOrderedUpdateProcessor(2)
+    updates = [(make_update(i, 1), 0.3) for i in range(1, 4)] + [(make_update(4, 2), 0)]
+    finished, _ = asyncio.run(run_updates(processor, updates))
+    assert finished[4] < 0.1
+    assert finished[3] >= 0.85
+
+
+def test_same_chat_is_sequential_and_limit_holds():
+    processor = ChatOrderedUpdateProcessor(2)
+    updates = [(make_update(i, i), 0.2) for i in range(1, 4)] + [(make_update(4, 1), 0)]
+    finished, order = asyncio.run(run_updates(processor, updates))
+    # Третьему чату приходится ждать свободного места, апдейт 4 идёт после апдейта 1 своего чата
+    assert finished[3] >= 0.35
+    assert order.index(4) > order.index(1)
+    assert finished[4] >= finished[1]
+    assert not processor._chat_locks
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит одновременно обрабатываемых апдейтов (подбирается под мощность GPU)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "8"))
+# Семафор базового класса держится всё время do_process_update, в том числе пока апдейт ждёт очереди
+# своего чата: апдейты занятого чата заняли бы все места и задержали остальные чаты. Поэтому ему
+# передаётся заведомо недостижимый лимит, а настоящий берётся только после блокировки чата
+_UNBOUNDED = 2 ** 31 - 1
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает апдейты разных чатов параллельно (не более max_concurrent_updates),
+    а апдейты одного чата — строго по очереди, чтобы состояние в context.user_data
+    (edit_section, setprompt_section) не гонялось.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(_UNBOUNDED)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks = {}
+        self._chat_waiters = {}
+
+    @staticmethod
+    def _chat_key(update):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        # Сначала очередь чата, потом глобальный лимит: место занимает только апдейт, который выполняется
+        key = self._chat_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._chat_waiters[key] -= 1
+            if not self._chat_waiters[key]:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def initialize(self):
+        logger.info(f"Параллельная обработка апдейтов: не более {self._limit} одновременно")
+
+    async def shutdown(self):
+        self._chat_locks.clear()
+        self._chat_waiters.clear()
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import signal
+import logging
+from telegram import Bot
+from pdf_processor import ollama
+from executor import shutdown_pools, set_cpu_initializer, start_cpu_pool
+from dossier_jobs import start_workers, JOB_WORKERS
+from renderer import warm_up
+from pregenerate import pregenerate_loop, PREGENERATE_INTERVAL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RENDER_WARMUP = os.getenv("RENDER_WARMUP", "1") == "1"
+
+
+async def run_worker(token):
+    """
+    Обработчик задач досье без приёма апдейтов: забирает задачи из общей очереди (cache/jobs.sqlite),
+    скачивает, разбирает, генерирует и рендерит досье. Готовое досье отправляет бот.
+    Процессов worker.py может быть сколько угодно, лишь бы у них был общий cache/.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    if RENDER_WARMUP:
+        set_cpu_initializer(warm_up)
+        await start_cpu_pool()
+    # Bot нужен только для скачивания выгрузок и сообщений об ошибках
+    async with Bot(token) as bot:
+        tasks = start_workers(bot, count=max(JOB_WORKERS, 1), deliver=False)
+        if PREGENERATE_INTERVAL > 0:
+            tasks.append(asyncio.create_task(pregenerate_loop()))
+        await stop.wait()
+        logger.info("Остановка обработчика, незавершённые задачи возвращаются в очередь")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await ollama.aclose()
+    shutdown_pools()
+
+
+def main():
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("TELEGRAM_BOT_TOKEN не задан!")
+        raise Exception("TELEGRAM_BOT_TOKEN не задан!")
+    asyncio.run(run_worker(token))
+
+
+if __name__ == "__main__":
+    main()